@@ -0,0 +1,157 @@
+import asyncio
+import math
+import time
+
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional
+from config import settings
+
+
+class QueueFullError(Exception):
+    """Raised when a stage's waiting line is full and the request should be retried later"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"Too many requests waiting for {stage}, retry in {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """A request's place in an AdmissionGate, from queueing until release"""
+
+    def __init__(self, gate: 'AdmissionGate'):
+        self._gate = gate
+        self._changed = asyncio.Event()
+        self.admitted = False
+        self.released = False
+        self.created = time.monotonic()
+        self.admitted_at: Optional[float] = None
+
+    @property
+    def position(self) -> int:
+        """1-based place in the waiting line, or 0 once admitted"""
+        return self._gate.position(self)
+
+    async def positions(self) -> AsyncIterator[int]:
+        """Yield the queue position whenever it changes, and return once admitted"""
+        while not self.admitted:
+            self._changed.clear()
+            yield self.position
+            await self._changed.wait()
+
+    async def wait(self):
+        """Wait until admitted"""
+        async for _ in self.positions():
+            pass
+
+    def release(self):
+        """Leave the gate, whether admitted or still waiting; safe to call more than once"""
+        if not self.released:
+            self.released = True
+            self._gate.release(self)
+
+
+class AdmissionGate:
+    """First-come, first-served concurrency limit with a bounded waiting line.
+
+    At most `limit` requests hold the gate at once. Up to `max_waiting` more wait
+    in FIFO order, and anything beyond that is rejected straight away with a
+    QueueFullError carrying a Retry-After estimate. Gates are used from the event
+    loop only, so they need no locking.
+    """
+
+    def __init__(self, stage: str, limit: int, max_waiting: int):
+        self.stage = stage
+        self.limit = max(limit, 1)
+        self.max_waiting = max_waiting
+        self._active = 0
+        self._waiting: Deque[AdmissionTicket] = deque()
+        # Moving average of how long requests hold the gate, for Retry-After
+        self._hold_seconds: Optional[float] = None
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'peak_waiting': 0}
+
+    @property
+    def full(self) -> bool:
+        return self._active >= self.limit and len(self._waiting) >= self.max_waiting
+
+    def check(self):
+        """Raise QueueFullError if a new request would be rejected"""
+        if self.full:
+            self._stats['rejected'] += 1
+            raise QueueFullError(self.stage, self.retry_after())
+
+    def enter(self) -> AdmissionTicket:
+        """Take a slot if one is free, otherwise join the waiting line"""
+        self.check()
+        ticket = AdmissionTicket(self)
+        if self._active < self.limit and not self._waiting:
+            self._admit(ticket)
+        else:
+            self._waiting.append(ticket)
+            self._stats['queued'] += 1
+            self._stats['peak_waiting'] = max(self._stats['peak_waiting'], len(self._waiting))
+        return ticket
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        if ticket.admitted:
+            return 0
+        try:
+            return self._waiting.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    def release(self, ticket: AdmissionTicket):
+        if ticket.admitted:
+            self._active -= 1
+            held = time.monotonic() - ticket.admitted_at
+            self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+        else:
+            try:
+                self._waiting.remove(ticket)
+            except ValueError:
+                pass
+
+        while self._active < self.limit and self._waiting:
+            self._admit(self._waiting.popleft())
+        # Everyone still waiting has moved up
+        for waiting in self._waiting:
+            waiting._changed.set()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new request"""
+        hold = self._hold_seconds if self._hold_seconds is not None else 1.0
+        return max(1, math.ceil(hold * (len(self._waiting) + 1) / self.limit))
+
+    def stats(self) -> Dict:
+        return dict(self._stats, stage=self.stage, limit=self.limit, max_waiting=self.max_waiting,
+                    active=self._active, waiting=len(self._waiting))
+
+    def _admit(self, ticket: AdmissionTicket):
+        self._active += 1
+        ticket.admitted = True
+        ticket.admitted_at = time.monotonic()
+        ticket._changed.set()
+        self._stats['admitted'] += 1
+
+
+class AdmissionController:
+    """The admission gates of the chat pipeline: one per model for generation, one for retrieval"""
+
+    def __init__(self):
+        self._generation: Dict[str, AdmissionGate] = {}
+        self.retrieval = AdmissionGate('retrieval', settings.RETRIEVAL_CONCURRENCY, settings.RETRIEVAL_QUEUE_SIZE)
+
+    def generation(self, model: str) -> AdmissionGate:
+        gate = self._generation.get(model)
+        if gate is None:
+            gate = AdmissionGate(f'generation:{model}',
+                                 settings.MODEL_GENERATION_CONCURRENCY.get(model, settings.GENERATION_CONCURRENCY),
+                                 settings.GENERATION_QUEUE_SIZE)
+            self._generation[model] = gate
+        return gate
+
+    def stats(self) -> Dict:
+        return {
+            'generation': {model: gate.stats() for model, gate in self._generation.items()},
+            'retrieval': self.retrieval.stats(),
+        }
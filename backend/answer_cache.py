@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+
+import numpy as np
+
+from cachetools import TTLCache
+from typing import Dict, List, Optional, Sequence
+from config import settings
+from metrics import ANSWER_CACHE_LOOKUPS
+
+
+def context_fingerprint(document_id: Optional[str] = None, search_links: Optional[Sequence[str]] = None,
+                        deep_search: bool = False) -> str:
+    """Identify the context an answer was generated from
+
+    Documents are identified by their content hash and web context by the set of
+    result links, so an answer is only reused for the same document and the same results.
+    """
+    context = {
+        'document': document_id,
+        'web': sorted(search_links) if search_links is not None else None,
+        'deep': deep_search if search_links is not None else None,
+    }
+    return hashlib.sha1(json.dumps(context).encode()).hexdigest()
+
+
+class AnswerCache:
+    """Thread-safe TTL/LRU cache of generated answers.
+
+    Answers are scoped by model and context fingerprint. Within a scope, a question
+    is answered from the cache when its embedding is at least `threshold` cosine
+    similar to a cached question's, so rephrasings of a question share an answer.
+    """
+
+    def __init__(self,
+                 max_entries: int = settings.ANSWER_CACHE_MAX_ENTRIES,
+                 ttl: int = settings.ANSWER_CACHE_TTL,
+                 threshold: float = settings.ANSWER_CACHE_SIMILARITY):
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl)
+        # Keys of the cached answers in each (model, fingerprint) scope; pruned as entries expire
+        self._scopes: Dict[tuple, List[tuple]] = {}
+        self._indexed = 0
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, model: str, fingerprint: str, query: str, query_embedding: Sequence[float]) -> Optional[Dict]:
+        """Get the cached answer to the most similar question within the threshold, if any"""
+        scope = (model, fingerprint)
+        vector = self._unit(query_embedding)
+        with self._lock:
+            entry = self._cache.get((scope, self.normalize(query)))
+            if entry is None:
+                best_similarity = self.threshold
+                keys = [key for key in self._scopes.get(scope, []) if key in self._cache]
+                if keys:
+                    self._scopes[scope] = keys
+                else:
+                    self._scopes.pop(scope, None)
+                for key in keys:
+                    candidate = self._cache[key]
+                    similarity = float(candidate['embedding'] @ vector)
+                    if similarity >= best_similarity:
+                        entry, best_similarity = candidate, similarity
+
+            if entry is None:
+                self.misses += 1
+                ANSWER_CACHE_LOOKUPS.labels('miss').inc()
+                return None
+            self.hits += 1
+            ANSWER_CACHE_LOOKUPS.labels('hit').inc()
+            return {'answer': entry['answer'], 'query': entry['query'], 'context_sources': entry['context_sources']}
+
+    def put(self, model: str, fingerprint: str, query: str, query_embedding: Sequence[float], answer: str,
+            context_sources: Optional[Dict[str, str]] = None):
+        """Cache an answer along with the status of each context source it was generated from"""
+        scope = (model, fingerprint)
+        key = (scope, self.normalize(query))
+        with self._lock:
+            if key not in self._cache:
+                self._scopes.setdefault(scope, []).append(key)
+                self._indexed += 1
+            self._cache[key] = {'query': query, 'answer': answer, 'context_sources': dict(context_sources or {}),
+                                'embedding': self._unit(query_embedding)}
+            if self._indexed > 2 * self._cache.maxsize:
+                # Drop the keys of evicted answers from scopes that haven't been looked up since
+                self._scopes = {}
+                for cached_scope, cached_query in self._cache.keys():
+                    self._scopes.setdefault(cached_scope, []).append((cached_scope, cached_query))
+                self._indexed = len(self._cache)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._cache),
+                'max_entries': self._cache.maxsize,
+                'ttl': self._cache.ttl,
+                'similarity_threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _unit(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,106 @@
+import os
+import random
+
+from typing import List
+
+# A fixed vocabulary with identifier-like tokens so lexical and dense retrieval both have something to find
+WORDS = (
+    "system service request response latency throughput memory cache index query document "
+    "model token stream server client network storage vector embedding chunk search result "
+    "error timeout retry config deploy cluster node worker queue batch process thread page"
+).split()
+
+
+def synthetic_paragraph(rng: random.Random, sentences: int = 5) -> str:
+    parts = []
+    for _ in range(sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+        # Sprinkle in error codes and part numbers, like the identifiers in real manuals
+        if rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), f"E{rng.randint(0, 9999):04d}")
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)), f"PN-{rng.randint(100, 999)}-{rng.randint(10, 99)}")
+        sentence = " ".join(words)
+        parts.append(sentence[0].upper() + sentence[1:] + ".")
+    return " ".join(parts)
+
+
+def synthetic_text(rng: random.Random, size_bytes: int) -> str:
+    paragraphs = []
+    size = 0
+    while size < size_bytes:
+        paragraph = synthetic_paragraph(rng)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_pdf(rng: random.Random, pages: int, lines_per_page: int = 40) -> bytes:
+    """Build a minimal PDF with a text layer, without needing a PDF library"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, filled in once the page objects are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for _ in range(pages):
+        lines = []
+        while len(lines) < lines_per_page:
+            words = synthetic_paragraph(rng, sentences=1).split()
+            lines.extend(" ".join(words[i:i + 12]) for i in range(0, len(words), 12))
+        text_ops = "\n".join(f"({_pdf_escape(line)}) Tj T*" for line in lines[:lines_per_page])
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td\n{text_ops}\nET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
+
+
+def build_corpus(directory: str, text_docs: int, text_size_kb: int,
+                 pdf_docs: int, pdf_pages: int, seed: int = 42) -> List[str]:
+    """Write a reproducible corpus of text and PDF files and return their paths"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(text_docs):
+        path = os.path.join(directory, f"doc-{i:03d}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(synthetic_text(rng, text_size_kb * 1024))
+        paths.append(path)
+    for i in range(pdf_docs):
+        path = os.path.join(directory, f"doc-{i:03d}.pdf")
+        with open(path, 'wb') as f:
+            f.write(synthetic_pdf(rng, pdf_pages))
+        paths.append(path)
+    return paths
+
+
+def synthetic_queries(rng: random.Random, count: int) -> List[str]:
+    queries = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 7))]
+        if rng.random() < 0.3:
+            words.append(f"E{rng.randint(0, 9999):04d}")
+        queries.append(" ".join(words) + "?")
+    return queries
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def create_app(tokens_per_second: float = 50.0, response_tokens: int = 200,
+               prompt_delay_ms: float = 50.0) -> Starlette:
+    """A stand-in for the Ollama API that streams fake tokens at a fixed rate
+
+    Args:
+        tokens_per_second: Generation rate of the fake model
+        response_tokens: Tokens in every response
+        prompt_delay_ms: Simulated prompt evaluation time before the first token
+    """
+
+    async def chat(request: Request):
+        body = await request.json()
+        model = body.get('model', 'fake')
+
+        if not body.get('stream', True):
+            return JSONResponse({'model': model, 'message': {'role': 'assistant', 'content': 'ok'},
+                                 'done': True})
+
+        async def generate():
+            start = time.perf_counter()
+            await asyncio.sleep(prompt_delay_ms / 1000)
+            eval_start = time.perf_counter()
+            for i in range(response_tokens):
+                chunk = {'model': model, 'message': {'role': 'assistant', 'content': f'token{i} '}, 'done': False}
+                yield json.dumps(chunk) + '\n'
+                await asyncio.sleep(1 / tokens_per_second)
+            now = time.perf_counter()
+            yield json.dumps({
+                'model': model,
+                'message': {'role': 'assistant', 'content': ''},
+                'done': True,
+                'done_reason': 'stop',
+                'total_duration': int((now - start) * 1e9),
+                'prompt_eval_count': sum(len(m.get('content', '')) // 4 for m in body.get('messages', [])),
+                'eval_count': response_tokens,
+                'eval_duration': int((now - eval_start) * 1e9),
+            }) + '\n'
+
+        return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+    async def generate(request: Request):
+        body = await request.json()
+        return JSONResponse({'model': body.get('model', 'fake'), 'response': '', 'done': True})
+
+    async def ps(request: Request):
+        return JSONResponse({'models': []})
+
+    return Starlette(routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/generate', generate, methods=['POST']),
+        Route('/api/ps', ps, methods=['GET']),
+    ])
@@ -0,0 +1,374 @@
+"""Offline benchmarks for the RAG and streaming paths.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --output benchmark-results.json
+
+Everything runs locally: the corpus is synthetic and Ollama is replaced by a
+stand-in server that streams fake tokens at a fixed rate. The embedding and
+reranking models must already be in the HuggingFace cache, or pass
+--fake-models to measure the pipeline without them. Settings are read once at
+import time, so compare values such as RAG_CHUNK_SIZE by running the suite once
+per value and diffing the JSON results.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+from benchmarks.corpus import build_corpus, synthetic_queries
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='benchmark-results.json', help='Where to write the JSON results')
+    parser.add_argument('--work-dir', default=None, help='Directory for the corpus and ChromaDB (default: a temp dir)')
+    parser.add_argument('--phases', default='ingestion,retrieval,streaming',
+                        help='Comma-separated phases to run')
+    parser.add_argument('--seed', type=int, default=42)
+
+    corpus = parser.add_argument_group('corpus')
+    corpus.add_argument('--text-docs', type=int, default=4)
+    corpus.add_argument('--text-size-kb', type=int, default=256)
+    corpus.add_argument('--pdf-docs', type=int, default=2)
+    corpus.add_argument('--pdf-pages', type=int, default=20)
+
+    rag = parser.add_argument_group('retrieval')
+    rag.add_argument('--queries', type=int, default=20, help='Queries per retrieval configuration')
+    rag.add_argument('--chunk-size', type=int, default=None, help='Override RAG_CHUNK_SIZE')
+    rag.add_argument('--chunk-overlap', type=int, default=None, help='Override RAG_CHUNK_OVERLAP')
+    rag.add_argument('--fetch-k', type=int, default=None, help='Override MMR_FETCH_K')
+    rag.add_argument('--top-k', type=int, default=None, help='Override MMR_TOP_K')
+    rag.add_argument('--fake-models', action='store_true',
+                     help='Use hashing embeddings and a word-overlap reranker instead of the real models')
+
+    stream = parser.add_argument_group('streaming')
+    stream.add_argument('--clients', default='1,4,16', help='Comma-separated concurrency levels')
+    stream.add_argument('--requests-per-client', type=int, default=2)
+    stream.add_argument('--tokens-per-second', type=float, default=50.0, help='Fake model generation rate')
+    stream.add_argument('--response-tokens', type=int, default=100, help='Tokens per fake response')
+    stream.add_argument('--prompt-delay-ms', type=float, default=50.0, help='Fake prompt evaluation time')
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def configure_environment(args: argparse.Namespace, work_dir: str, ollama_port: int):
+    """Point the backend at the work dir and the fake Ollama; must run before importing it"""
+    chroma_dir = os.path.join(work_dir, 'chroma')
+    os.environ['CHROMA_PERSIST_DIRECTORY'] = chroma_dir
+    os.environ['DOCUMENT_CACHE_INDEX_FILE'] = os.path.join(chroma_dir, 'document_cache.json')
+    os.environ['UPLOAD_TEMP_DIR'] = os.path.join(work_dir, 'uploads')
+    os.environ['OLLAMA_HOST'] = os.environ['OLLAMA_HOST_URL'] = 'http://127.0.0.1'
+    os.environ['OLLAMA_PORT'] = str(ollama_port)
+    os.environ['WARMUP_ON_STARTUP'] = 'false'
+    overrides = {
+        'RAG_CHUNK_SIZE': args.chunk_size,
+        'RAG_CHUNK_OVERLAP': args.chunk_overlap,
+        'MMR_FETCH_K': args.fetch_k,
+        'MMR_TOP_K': args.top_k,
+    }
+    for name, value in overrides.items():
+        if value is not None:
+            os.environ[name] = str(value)
+
+
+class HashingEmbeddings:
+    """Deterministic bag-of-words embeddings for running without the real model"""
+
+    dimensions = 384
+
+    def _embed(self, text: str) -> List[float]:
+        import numpy as np
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class OverlapReranker:
+    """Scores pairs by word overlap, standing in for the cross-encoder"""
+
+    def predict(self, pairs, batch_size: int = 32):
+        return [len(set(query.lower().split()) & set(text.lower().split())) for query, text in pairs]
+
+
+def install_fake_models():
+    import rag_utils
+    from lazy_resource import LazyResource
+    rag_utils.embedding_model = LazyResource('hashing embeddings', HashingEmbeddings)
+    rag_utils._load_reranker = OverlapReranker
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def latency_summary(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {'count': 0, 'mean_ms': None, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+    ordered = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 2),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+
+def sum_stages(all_timings) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for timings in all_timings:
+        for stage, seconds in timings.stages.items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+    return {stage: round(seconds * 1000, 2) for stage, seconds in totals.items()}
+
+
+def bench_ingestion(manager, paths: List[str]) -> Dict:
+    from metrics import RequestTimings
+
+    def ingest_all():
+        latencies = {'txt': [], 'pdf': []}
+        all_timings = []
+        chunks = 0
+        start = time.perf_counter()
+        for path in paths:
+            timings = RequestTimings()
+            doc_start = time.perf_counter()
+            doc_id = manager.process_file(path, os.path.basename(path), timings=timings)
+            latencies[path.rsplit('.', 1)[-1]].append(time.perf_counter() - doc_start)
+            all_timings.append(timings)
+            entry = manager.document_cache.peek(doc_id)
+            chunks += len(entry['chunk_ids']) if entry else 0
+        return time.perf_counter() - start, latencies, all_timings, chunks
+
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    elapsed, latencies, all_timings, chunks = ingest_all()
+    # The second pass hits the document cache for every file
+    cached_elapsed, cached_latencies, _, _ = ingest_all()
+    return {
+        'documents': len(paths),
+        'bytes': total_bytes,
+        'chunks': chunks,
+        'seconds': round(elapsed, 3),
+        'documents_per_second': round(len(paths) / elapsed, 3),
+        'mb_per_second': round(total_bytes / 1024 / 1024 / elapsed, 3),
+        'chunks_per_second': round(chunks / elapsed, 1),
+        'latency': {kind: latency_summary(samples) for kind, samples in latencies.items()},
+        'stage_total_ms': sum_stages(all_timings),
+        'cached_latency': latency_summary(cached_latencies['txt'] + cached_latencies['pdf']),
+        'cached_seconds': round(cached_elapsed, 3),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_retrieval(manager, doc_ids: List[str], queries: List[str]) -> Dict:
+    from config import settings
+    from metrics import RequestTimings
+
+    results = {}
+    for use_mmr in (True, False):
+        for use_reranking in (True, False):
+            latencies = []
+            all_timings = []
+            for i, query in enumerate(queries):
+                timings = RequestTimings()
+                start = time.perf_counter()
+                manager.get_relevant_context(
+                    query=query,
+                    document_id=doc_ids[i % len(doc_ids)],
+                    use_mmr=use_mmr,
+                    use_reranking=use_reranking,
+                    top_k=settings.MMR_TOP_K,
+                    fetch_k=settings.MMR_FETCH_K,
+                    lambda_mult=settings.MMR_LAMBDA_MULT,
+                    use_hybrid=settings.HYBRID_SEARCH_ENABLED,
+                    timings=timings
+                )
+                latencies.append(time.perf_counter() - start)
+                all_timings.append(timings)
+            name = f"mmr_{'on' if use_mmr else 'off'}_rerank_{'on' if use_reranking else 'off'}"
+            results[name] = dict(latency_summary(latencies), stage_total_ms=sum_stages(all_timings))
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def start_server(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def stream_once(client, url: str, **kwargs) -> Dict:
+    start = time.perf_counter()
+    first_token = None
+    events = 0
+    received = 0
+    async with client.stream('POST', url, **kwargs) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            events += 1
+            received += len(line) + 2
+            if first_token is None and json.loads(line[5:]).get('content'):
+                first_token = time.perf_counter() - start
+    return {'ttft': first_token, 'duration': time.perf_counter() - start, 'events': events, 'bytes': received}
+
+
+async def bench_streaming_level(base_url: str, clients: int, requests_per_client: int,
+                                path: str, payload: Dict) -> Dict:
+    import httpx
+
+    async def client_loop(client):
+        results = []
+        for _ in range(requests_per_client):
+            results.append(await stream_once(client, base_url + path, **payload))
+        return results
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        start = time.perf_counter()
+        per_client = await asyncio.gather(*(client_loop(client) for _ in range(clients)))
+        wall = time.perf_counter() - start
+
+    results = [result for client_results in per_client for result in client_results]
+    events = sum(result['events'] for result in results)
+    return {
+        'clients': clients,
+        'requests': len(results),
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(len(results) / wall, 3),
+        'events_per_second': round(events / wall, 1),
+        'bytes_per_second': round(sum(result['bytes'] for result in results) / wall, 1),
+        'time_to_first_token': latency_summary([r['ttft'] for r in results if r['ttft'] is not None]),
+        'duration': latency_summary([r['duration'] for r in results]),
+    }
+
+
+def bench_streaming(args: argparse.Namespace, ollama_port: int, document_path: str) -> Dict:
+    import httpx
+    from benchmarks.fake_ollama import create_app
+
+    fake_ollama, _ = start_server(create_app(args.tokens_per_second, args.response_tokens, args.prompt_delay_ms),
+                                  ollama_port)
+    import main
+    api_port = free_port()
+    api, _ = start_server(main.app, api_port)
+    base_url = f'http://127.0.0.1:{api_port}'
+
+    try:
+        with open(document_path, 'rb') as f:
+            document = httpx.post(base_url + '/documents', files={'file': (os.path.basename(document_path), f)},
+                                  timeout=None).json()
+        while document['status'] in ('queued', 'processing'):
+            time.sleep(0.1)
+            document = httpx.get(f"{base_url}/documents/{document['document_id']}").json()
+
+        endpoints = {
+            'chat_stream': ('/chat/stream', {'json': {'query': 'Describe the cache settings.'}}),
+            'chat_stream_with_context': ('/chat/stream-with-context', {
+                'data': {'query': 'Which error codes mention the queue?', 'document_id': document['document_id']}
+            }),
+        }
+        results = {}
+        for name, (path, payload) in endpoints.items():
+            results[name] = [
+                asyncio.run(bench_streaming_level(base_url, clients, args.requests_per_client, path, payload))
+                for clients in (int(level) for level in args.clients.split(','))
+            ]
+        results['peak_rss_mb'] = peak_rss_mb()
+        return results
+    finally:
+        api.should_exit = True
+        fake_ollama.should_exit = True
+
+
+def main():
+    args = parse_args()
+    phases = set(args.phases.split(','))
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='ii-chatbot-bench-')
+    ollama_port = free_port()
+    configure_environment(args, work_dir, ollama_port)
+
+    # Import the backend only after the environment points it at the work dir
+    from config import settings
+    if args.fake_models:
+        install_fake_models()
+    from rag_utils import RAGManager
+
+    paths = build_corpus(os.path.join(work_dir, 'corpus'), args.text_docs, args.text_size_kb,
+                         args.pdf_docs, args.pdf_pages, args.seed)
+    queries = synthetic_queries(random.Random(args.seed), args.queries)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': dict(vars(args), settings={
+            name: getattr(settings, name) for name in (
+                'RAG_CHUNK_SIZE', 'RAG_CHUNK_OVERLAP', 'EMBEDDING_MODEL', 'EMBEDDING_BATCH_SIZE',
+                'MMR_FETCH_K', 'MMR_TOP_K', 'MMR_LAMBDA_MULT', 'RERANKING_MODEL', 'HYBRID_SEARCH_ENABLED',
+            )
+        }),
+        'results': {},
+    }
+
+    manager = RAGManager()
+    try:
+        manager.warm_up()
+        if phases & {'ingestion', 'retrieval'}:
+            print("Benchmarking ingestion...")
+            report['results']['ingestion'] = bench_ingestion(manager, paths)
+        if 'retrieval' in phases:
+            print("Benchmarking retrieval...")
+            doc_ids = [manager.document_cache.compute_key(manager.document_cache.file_digest(path)) for path in paths]
+            report['results']['retrieval'] = bench_retrieval(manager, doc_ids, queries)
+        if 'streaming' in phases:
+            print("Benchmarking streaming...")
+            report['results']['streaming'] = bench_streaming(args, ollama_port, paths[0])
+    finally:
+        manager.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 import os
 
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -13,25 +15,134 @@ class Settings(BaseSettings):
     
     # Available models for the dropdown selector
     AVAILABLE_MODELS: list = ['deepseek-r1:latest', 'gemma3:latest']
+    OLLAMA_MAX_CONNECTIONS: int = 64  # Size of the shared HTTP connection pool to Ollama
+    
+    # Model residency settings; Ollama reloads a model whenever num_ctx changes, so it is fixed per model
+    OLLAMA_KEEP_ALIVE: str = '30m'  # How long Ollama keeps a model loaded after a request, "-1m" keeps it loaded
+    MODEL_KEEP_ALIVE: dict = {}     # Per-model overrides, e.g. {"deepseek-r1:latest": "-1m"} to pin a model
+    OLLAMA_NUM_CTX: int = 4096      # Context window requested for every model
+    MODEL_NUM_CTX: dict = {}        # Per-model overrides, e.g. {"gemma3:latest": 8192}
+    OLLAMA_PRELOAD_MODELS: list = ['deepseek-r1:latest']  # Loaded at startup when WARMUP_ON_STARTUP is enabled
+    
+    # Load the embedding and reranking models in the background after startup
+    # instead of on the first request that needs them
+    WARMUP_ON_STARTUP: bool = True
+    
+    # Compact streaming settings, used when a client asks for stream_format=compact
+    STREAM_COALESCE_WINDOW_MS: int = 50   # Longest time tokens are held back to be sent together
+    STREAM_COALESCE_MAX_BYTES: int = 512  # Tokens are sent as soon as this many bytes are buffered
+    
+    # Conversation settings
+    CONVERSATION_TTL: int = 3600           # Seconds before an unused chat session is discarded
+    CONVERSATION_MAX_SESSIONS: int = 1000  # Maximum number of chat sessions kept in memory
+    CONVERSATION_MAX_TURNS: int = 20       # Turns kept verbatim per session; older ones are summarized
+    CONVERSATION_SUMMARY_CHARS: int = 2000 # Maximum length of the summary of older turns
+    
+    # Prompt budget settings
+    PROMPT_TOKEN_BUDGET: int = 3072  # Maximum prompt tokens, leaving room for the answer in the context window
+    MODEL_PROMPT_TOKEN_BUDGETS: dict = {}  # Per-model overrides, e.g. {"gemma3:latest": 6144}
+    # HuggingFace tokenizers used to count prompt tokens per model; models without one use an estimate
+    MODEL_TOKENIZERS: dict = {}
+    
+    # Admission control; requests beyond a queue's size are rejected with 429 and a Retry-After header
+    GENERATION_CONCURRENCY: int = 4         # Concurrent generations per model, ideally Ollama's OLLAMA_NUM_PARALLEL
+    MODEL_GENERATION_CONCURRENCY: dict = {} # Per-model overrides, e.g. {"gemma3:latest": 2}
+    GENERATION_QUEUE_SIZE: int = 32         # Requests waiting for a generation slot, per model
+    RETRIEVAL_CONCURRENCY: int = 8          # Concurrent document retrievals (search, reranking, MMR)
+    RETRIEVAL_QUEUE_SIZE: int = 64          # Requests waiting to retrieve document context
+    INGESTION_QUEUE_SIZE: int = 16          # Uploads waiting to be indexed
+    
+    # Context deadlines; sources that miss them are left out and generation starts with the rest
+    DOCUMENT_WAIT_DEADLINE_MS: int = 30000    # Longest wait for an attached document to finish indexing
+    DOCUMENT_CONTEXT_DEADLINE_MS: int = 5000  # Longest document retrieval, once the document is indexed
+    WEB_CONTEXT_DEADLINE_MS: int = 5000       # Longest web search and page reading, from the start of the request
+    
+    # Executor settings
+    INGESTION_WORKERS: int = 2  # Threads for file parsing, OCR and embedding
+    INGESTION_JOB_HISTORY: int = 1000  # Finished indexing jobs kept for status lookups
+    RETRIEVAL_WORKERS: int = 8  # Threads for similarity search, reranking and web search
     
     # RAG settings
     RAG_CHUNK_SIZE: int = 1000
     RAG_CHUNK_OVERLAP: int = 200
+    EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"  # HuggingFace model used to embed document chunks
+    EMBEDDING_BATCH_SIZE: int = 256  # Chunks embedded and written to ChromaDB at a time
+    EMBEDDING_ENCODE_BATCH_SIZE: int = 64    # Chunks per forward pass of the embedding model
+    EMBEDDING_WORKERS: int = 0               # Embedding worker processes for large documents, 0 embeds in the server process
+    EMBEDDING_PROCESS_MIN_BATCH: int = 128   # Smaller batches are embedded in-process, where the pool costs more than it saves
+    # 'float16' or 'int8' keeps a compact archive of every document so idle ones can leave ChromaDB
+    EMBEDDING_STORAGE_DTYPE: str = 'float32'
+    
+    # Upload settings
+    UPLOAD_MAX_BYTES: int = 100 * 1024 * 1024  # Larger uploads are rejected with 413
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024       # Bytes read from the request per write to disk
+    UPLOAD_TEMP_DIR: Optional[str] = None      # Where uploads are staged, defaults to the system temp dir
+    
+    # OCR settings
+    OCR_MIN_PAGE_CHARS: int = 20  # Pages with less extractable text than this are OCR'd
+    OCR_WORKERS: int = 0          # OCR worker processes, 0 uses all available cores
+    OCR_BATCH_PAGES: int = 4      # Pages rasterized at once by each OCR task
+    OCR_DPI: int = 200            # Rasterization resolution for OCR
     
     # MMR settings
     MMR_ENABLED: bool = True  # Enable/disable MMR retrieval
-    MMR_FETCH_K: int = 30     # Number of documents to consider before filtering
+    MMR_FETCH_K: int = 20     # Number of documents to consider before filtering
     MMR_TOP_K: int = 5        # Number of documents to return after MMR filtering
     MMR_LAMBDA_MULT: float = 0.7  # Diversity-relevance tradeoff (0-1). Higher values prioritize relevance
     
+    # Hybrid search settings
+    HYBRID_SEARCH_ENABLED: bool = True  # Fuse BM25 keyword matches with the vector search candidates
+    BM25_FETCH_K: int = 10     # Number of keyword matches fused with the vector candidates
+    BM25_K1: float = 1.5       # BM25 term frequency saturation
+    BM25_B: float = 0.75       # BM25 document length normalization
+    BM25_MAX_INDEXES: int = 32 # Per-document BM25 indexes kept in memory; the rest are loaded from disk
+    RRF_K: int = 60            # Reciprocal rank fusion constant; higher values flatten the rank weights
+    
     # Reranking settings
     RERANKING_ENABLED: bool = True  # Enable/disable reranking
     RERANKING_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"  # Model to use for reranking
+    RERANK_BATCH_SIZE: int = 128    # Maximum query/chunk pairs scored in one predict call
+    RERANK_MAX_WAIT_MS: int = 10    # How long to wait for other requests to join a batch
+    RERANK_QUEUE_SIZE: int = 64     # Maximum pending rerank requests before callers block
+    RERANK_CACHE_SIZE: int = 10000  # Cached (query, chunk) scores
+    RERANK_SKIP_MARGIN: float = 0.15    # Skip reranking when the top_k candidates lead the rest by this similarity
+    RERANK_SHRINK_MARGIN: float = 0.25  # Only rerank candidates within this similarity of the top_k-th candidate
     
+    # Web search cache settings
+    SEARCH_CACHE_MAX_ENTRIES: int = 1000  # Maximum number of cached queries before LRU eviction
+    SEARCH_CACHE_TTL: int = 900           # Seconds before cached search results expire
+
+    # Answer cache settings; answers are reused for similar questions about the same document or search results
+    ANSWER_CACHE_ENABLED: bool = False     # Replay cached answers instead of generating them again
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000   # Maximum number of cached answers before LRU eviction
+    ANSWER_CACHE_TTL: int = 3600           # Seconds before a cached answer expires
+    ANSWER_CACHE_SIMILARITY: float = 0.95  # Minimum cosine similarity between questions to reuse an answer
+    
+    # Deep web search settings, used when a request asks for deep_search
+    WEB_FETCH_MAX_PAGES: int = 5          # Top search results whose pages are fetched
+    WEB_FETCH_BUDGET_MS: int = 2500       # Pages not fetched and extracted within this are dropped
+    WEB_FETCH_TIMEOUT: float = 2.0        # Seconds allowed per page, including connecting and reading
+    WEB_FETCH_HOST_TIMEOUTS: dict = {}    # Per-host overrides, e.g. {"en.wikipedia.org": 1.0}
+    WEB_FETCH_MAX_BYTES: int = 2 * 1024 * 1024  # Pages are truncated after this many bytes
+    WEB_FETCH_MAX_CONNECTIONS: int = 32   # Size of the shared HTTP connection pool for page fetches
+    WEB_FETCH_USER_AGENT: str = 'Mozilla/5.0 (compatible; II-Chatbot/1.0)'
+    WEB_PAGE_MIN_CHARS: int = 200         # Pages with less extracted text than this are skipped
+    WEB_PAGE_MAX_CHUNKS: int = 40         # Chunks per page considered for the context
+    WEB_CONTEXT_TOP_K: int = 5            # Page chunks sent to the model
+    WEB_PAGE_CACHE_MAX_ENTRIES: int = 500 # Extracted pages kept before LRU eviction
+    WEB_PAGE_CACHE_TTL: int = 600         # Seconds a cached page is used before revalidating it with ETag/Last-Modified
+
     # ChromaDB settings
     CHROMA_PERSIST_DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db/chroma")
     CHROMA_COLLECTION_NAME: str = "ii-chatbot-collection"
     CHROMA_DISTANCE_FUNCTION: str = "cosine"
+    CHROMA_COLLECTION_IDLE_TTL: int = 1800  # Seconds before an unused per-document collection handle is closed
+
+    # Document cache settings
+    DOCUMENT_CACHE_ENABLED: bool = True  # Skip parsing and embedding files that are already in ChromaDB
+    DOCUMENT_CACHE_MAX_DOCUMENTS: int = 100  # Maximum number of cached documents before LRU eviction
+    DOCUMENT_CACHE_MAX_CHUNKS: int = 50000   # Maximum number of cached chunks across all documents
+    DOCUMENT_CACHE_INDEX_FILE: str = os.path.join(CHROMA_PERSIST_DIRECTORY, "document_cache.json")
 
 
 # Load settings
@@ -0,0 +1,194 @@
+import re
+import threading
+import time
+import uuid
+
+from cachetools import TTLCache
+from typing import Dict, List, Optional
+from config import settings
+from token_budget import get_prompt_budget, get_token_counter
+
+# Reasoning models wrap their chain of thought in <think> tags; it is not worth keeping in history
+THINK_PATTERN = re.compile(r'<think>.*?</think>\s*', re.DOTALL)
+
+
+class ConversationStore:
+    """In-memory chat sessions that expire after `ttl` seconds without use.
+
+    Only the visible question and answer of each turn are kept. Once a session
+    has more than `max_turns` turns, the oldest are folded into a short
+    extractive summary instead of being kept verbatim.
+    """
+
+    def __init__(self,
+                 ttl: int = settings.CONVERSATION_TTL,
+                 max_sessions: int = settings.CONVERSATION_MAX_SESSIONS,
+                 max_turns: int = settings.CONVERSATION_MAX_TURNS,
+                 max_summary_chars: int = settings.CONVERSATION_SUMMARY_CHARS):
+        self.max_turns = max_turns
+        self.max_summary_chars = max_summary_chars
+        self._sessions = TTLCache(maxsize=max_sessions, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def create(self) -> str:
+        """Start an empty session and return its ID"""
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = self._new_session()
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Get a copy of a session's summary and turns, refreshing its expiry"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            # Re-inserting restarts the TTL, so active sessions don't expire
+            self._sessions[session_id] = session
+            return {
+                'session_id': session_id,
+                'summary': session['summary'],
+                'turns': [dict(turn) for turn in session['turns']],
+                'created': session['created'],
+                'updated': session['updated'],
+            }
+
+    def append(self, session_id: str, user: str, assistant: str):
+        """Record a finished turn, creating the session if it expired or never existed"""
+        turn = {'user': user.strip(), 'assistant': self.compact(assistant), 'created': time.time()}
+        with self._lock:
+            session = self._sessions.get(session_id) or self._new_session()
+            session['turns'].append(turn)
+            while len(session['turns']) > self.max_turns:
+                session['summary'] = self._fold(session['summary'], session['turns'].pop(0))
+            session['updated'] = turn['created']
+            self._sessions[session_id] = session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self._sessions.maxsize,
+                'ttl': self._sessions.ttl,
+            }
+
+    @staticmethod
+    def compact(text: str) -> str:
+        return THINK_PATTERN.sub('', text).strip()
+
+    @staticmethod
+    def summarize_turn(turn: Dict) -> str:
+        """One-line extractive summary: the question and the first sentence of the answer"""
+        question = " ".join(turn['user'].split())[:200]
+        answer = " ".join(turn['assistant'].split())
+        first_sentence = re.split(r'(?<=[.!?])\s', answer, maxsplit=1)[0][:200]
+        return f"- User: {question} | Assistant: {first_sentence}"
+
+    def _fold(self, summary: str, turn: Dict) -> str:
+        summary = f"{summary}\n{self.summarize_turn(turn)}".strip()
+        # Keep the most recent lines when the summary outgrows its limit
+        while len(summary) > self.max_summary_chars and "\n" in summary:
+            summary = summary.split("\n", 1)[1]
+        return summary[-self.max_summary_chars:]
+
+    @staticmethod
+    def _new_session() -> Dict:
+        now = time.time()
+        return {'summary': '', 'turns': [], 'created': now, 'updated': now}
+
+
+def build_chat_messages(model: str, query: str, instructions: str = "",
+                        context_parts: Optional[List[str]] = None,
+                        session: Optional[Dict] = None) -> List[Dict[str, str]]:
+    """Assemble chat messages that fit the model's prompt token budget
+
+    The layout keeps the prompt prefix stable so Ollama can reuse its KV cache:
+    the fixed instructions and the conversation summary come first, then the
+    earlier turns, which only grow from one request to the next, and the
+    retrieved context goes last, in the final user message with the query.
+
+    Parts are admitted in priority order until the budget runs out: the query and
+    instructions, the latest turn, the context parts in the order given (truncated
+    if they don't fit whole), older turns from newest to oldest, and finally a
+    summary of the turns that were left out.
+
+    Args:
+        model: Model the prompt is for, which selects the budget and tokenizer
+        query: The user's current message
+        instructions: System instructions, sent only when non-empty
+        context_parts: Retrieved context blocks, most important first
+        session: Conversation from ConversationStore.get, if any
+
+    Returns:
+        Messages for the Ollama chat API
+    """
+    counter = get_token_counter(model)
+    remaining = get_prompt_budget(model)
+    remaining -= counter.count_message({'content': query})
+    if instructions or context_parts or session:
+        remaining -= counter.count(instructions) + counter.MESSAGE_OVERHEAD
+
+    turns = session['turns'] if session else []
+    turn_costs = [counter.count(turn['user']) + counter.count(turn['assistant']) + 2 * counter.MESSAGE_OVERHEAD
+                  for turn in turns]
+    kept_turns = set()
+
+    # The latest turn is what follow-up questions usually refer to
+    if turns and turn_costs[-1] <= remaining:
+        kept_turns.add(len(turns) - 1)
+        remaining -= turn_costs[-1]
+
+    kept_context = []
+    trimmed_context = 0
+    for part in context_parts or []:
+        kept = counter.truncate(part, remaining)
+        if kept != part:
+            trimmed_context += 1
+        if kept:
+            kept_context.append(kept)
+            remaining -= counter.count(kept)
+
+    for i in range(len(turns) - 2, -1, -1):
+        if turn_costs[i] > remaining:
+            break
+        kept_turns.add(i)
+        remaining -= turn_costs[i]
+
+    summary_lines = session['summary'].splitlines() if session and session['summary'] else []
+    summary_lines += [ConversationStore.summarize_turn(turns[i]) for i in range(len(turns)) if i not in kept_turns]
+    summary = ""
+    if summary_lines:
+        # Keep the most recent summary lines that fit
+        header = "Summary of the earlier conversation:"
+        remaining -= counter.count(header)
+        kept_lines = []
+        for line in reversed(summary_lines):
+            cost = counter.count(line) + 1
+            if cost > remaining:
+                break
+            kept_lines.insert(0, line)
+            remaining -= cost
+        if kept_lines:
+            summary = "\n".join([header, *kept_lines])
+
+    system_content = "\n\n".join(part for part in [instructions, summary] if part)
+    messages = []
+    if system_content:
+        messages.append({'role': 'system', 'content': system_content})
+    for i in sorted(kept_turns):
+        messages.append({'role': 'user', 'content': turns[i]['user']})
+        messages.append({'role': 'assistant', 'content': turns[i]['assistant']})
+    if kept_context:
+        messages.append({'role': 'user', 'content': "\n\n".join([*kept_context, f"Question: {query}"])})
+    else:
+        messages.append({'role': 'user', 'content': query})
+
+    dropped = len(turns) - len(kept_turns)
+    if dropped or trimmed_context:
+        print(f"Trimmed prompt for {model}: left out {dropped} of {len(turns)} turns, "
+              f"cut {trimmed_context} of {len(context_parts or [])} context parts")
+    return messages
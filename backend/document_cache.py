@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config import settings
+
+
+class DocumentCache:
+    """LRU index of documents that are already embedded in the vector store.
+
+    Entries are keyed by a hash of the file contents together with the chunking and
+    embedding settings, so a repeat upload of the same file can skip parsing, OCR
+    and embedding, while a settings change naturally invalidates old entries.
+    The index is persisted next to the ChromaDB data so it survives restarts.
+    """
+
+    def __init__(self,
+                 index_path: str = settings.DOCUMENT_CACHE_INDEX_FILE,
+                 max_documents: int = settings.DOCUMENT_CACHE_MAX_DOCUMENTS,
+                 max_chunks: int = settings.DOCUMENT_CACHE_MAX_CHUNKS):
+        self.index_path = index_path
+        self.max_documents = max_documents
+        self.max_chunks = max_chunks
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load()
+
+    @staticmethod
+    def file_digest(file_path: str, block_size: int = 1024 * 1024) -> str:
+        """Return the SHA-256 of a file's contents, reading it in blocks"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while block := f.read(block_size):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def compute_key(content_hash: str) -> str:
+        """Return the cache key for a file's SHA-256 under the current settings"""
+        key = f"{content_hash}|{settings.RAG_CHUNK_SIZE}|{settings.RAG_CHUNK_OVERLAP}|{settings.EMBEDDING_MODEL}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Look up a document and mark it as most recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry['last_used'] = time.time()
+            self.hits += 1
+            return dict(entry)
+
+    def peek(self, key: str) -> Optional[Dict]:
+        """Look up a document without touching its recency or the hit/miss counters"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry else None
+
+    def keys(self) -> List[str]:
+        """Keys of the cached documents, least recently used first"""
+        with self._lock:
+            return list(self._entries)
+
+    def put(self, key: str, file_name: str, chunk_ids: List[str]) -> List[Dict]:
+        """Record an ingested document and return the entries evicted to make room for it"""
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                'key': key,
+                'file_name': file_name,
+                'chunk_ids': list(chunk_ids),
+                'created': now,
+                'last_used': now,
+            }
+            self._entries.move_to_end(key)
+            evicted = self._evict()
+            self._save()
+        return evicted
+
+    def remove(self, key: str) -> Optional[Dict]:
+        """Forget a document, e.g. when its chunks are missing from the vector store"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._save()
+            return entry
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'documents': len(self._entries),
+                'chunks': self._total_chunks(),
+                'max_documents': self.max_documents,
+                'max_chunks': self.max_chunks,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+    def _total_chunks(self) -> int:
+        return sum(len(entry['chunk_ids']) for entry in self._entries.values())
+
+    def _evict(self) -> List[Dict]:
+        # Always keep the most recently added document, even if it alone exceeds the chunk budget
+        evicted = []
+        while len(self._entries) > 1 and (len(self._entries) > self.max_documents
+                                          or self._total_chunks() > self.max_chunks):
+            _, entry = self._entries.popitem(last=False)
+            evicted.append(entry)
+            self.evictions += 1
+        return evicted
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            for entry in sorted(entries, key=lambda e: e.get('last_used', 0)):
+                self._entries[entry['key']] = entry
+        except Exception as e:
+            print(f"Error loading document cache index: {e}")
+            self._entries.clear()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self._entries.values()), f)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"Error saving document cache index: {e}")
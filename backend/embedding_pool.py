@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+from config import settings
+
+# This module is imported by the embedding worker processes, so keep its imports light
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int):
+    global _worker_model
+    # Each worker gets an equal share of the cores instead of every worker using all of them
+    import torch
+    torch.set_num_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name, device='cpu')
+
+
+def embed_texts(texts: Sequence[str], batch_size: int) -> List[List[float]]:
+    """Embed texts in a worker exactly like HuggingFaceEmbeddings.embed_documents does"""
+    texts = [text.replace("\n", " ") for text in texts]
+    return _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False).tolist()
+
+
+class EmbeddingPool:
+    """Process pool that embeds large batches of chunks in parallel.
+
+    Every worker loads its own copy of the embedding model and limits torch to
+    its share of the cores. Slices of a batch are embedded concurrently and
+    merged back in order, producing the same vectors as the in-process model.
+    """
+
+    def __init__(self,
+                 workers: int = settings.EMBEDDING_WORKERS,
+                 encode_batch_size: int = settings.EMBEDDING_ENCODE_BATCH_SIZE,
+                 model_name: str = settings.EMBEDDING_MODEL):
+        self.workers = workers
+        self.encode_batch_size = encode_batch_size
+        self.model_name = model_name
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed texts across the workers and return the vectors in input order"""
+        slice_size = max(self.encode_batch_size, -(-len(texts) // self.workers))
+        slices = [texts[i:i + slice_size] for i in range(0, len(texts), slice_size)]
+        vectors = []
+        for slice_vectors in self._get_executor().map(embed_texts, slices, [self.encode_batch_size] * len(slices)):
+            vectors.extend(slice_vectors)
+        return vectors
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                # Spawn rather than fork so workers don't inherit the parent's torch state
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, threads)
+                )
+            return self._executor
@@ -0,0 +1,153 @@
+import asyncio
+import math
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Dict, Optional
+from admission import QueueFullError
+from config import settings
+from metrics import RequestTimings
+from rag_utils import RAGManager
+from upload_utils import SavedUpload, remove_upload
+
+
+class IngestionJobManager:
+    """Indexes uploaded documents on a background executor and tracks their progress.
+
+    A document's id is its content hash under the current chunking settings, so it
+    is known as soon as the upload has been saved and the same file uploaded twice
+    is only indexed once. At most `max_queued` jobs wait for a worker; further
+    uploads are rejected with QueueFullError.
+    """
+
+    def __init__(self, rag_manager: RAGManager, executor: Executor,
+                 max_jobs: int = settings.INGESTION_JOB_HISTORY,
+                 max_queued: int = settings.INGESTION_QUEUE_SIZE,
+                 workers: int = settings.INGESTION_WORKERS):
+        self.rag_manager = rag_manager
+        self._executor = executor
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.workers = workers
+        # Moving average of job duration, for Retry-After
+        self._job_seconds: Optional[float] = None
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, upload: SavedUpload) -> Dict:
+        """Queue an upload for indexing and return its job status; the job takes ownership of the file"""
+        document_id = self.rag_manager.document_cache.compute_key(upload.sha256)
+        with self._lock:
+            job = self._jobs.get(document_id)
+            if job and job['status'] in ('queued', 'processing'):
+                # Already being indexed, so this copy of the file isn't needed
+                remove_upload(upload.path)
+                return dict(job)
+
+            queued = sum(1 for job in self._jobs.values() if job['status'] == 'queued')
+            if queued >= self.max_queued:
+                remove_upload(upload.path)
+                job_seconds = self._job_seconds if self._job_seconds is not None else 5.0
+                raise QueueFullError('ingestion', max(1, math.ceil(job_seconds * (queued + 1) / self.workers)))
+
+            job = {
+                'document_id': document_id,
+                'file_name': upload.file_name,
+                'size': upload.size,
+                'status': 'queued',
+                'chunks_indexed': 0,
+                'error': None,
+                'created': time.time(),
+                'started': None,
+                'finished': None,
+                'timings': None,
+            }
+            self._jobs[document_id] = job
+            self._jobs.move_to_end(document_id)
+            self._trim()
+            future = self._executor.submit(self._run, document_id, upload)
+            self._futures[document_id] = future
+        future.add_done_callback(lambda done: self._on_done(document_id, upload, done))
+        return dict(job)
+
+    def status(self, document_id: str) -> Optional[Dict]:
+        """Get the indexing status of a document, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(document_id)
+            if job:
+                return dict(job)
+
+        # Documents indexed before a restart are only known to the document cache
+        entry = self.rag_manager.document_cache.peek(document_id)
+        if entry:
+            return {
+                'document_id': document_id,
+                'file_name': entry['file_name'],
+                'status': 'ready',
+                'chunks_indexed': len(entry['chunk_ids']),
+                'error': None,
+            }
+        return None
+
+    async def wait(self, document_id: str) -> Optional[Dict]:
+        """Wait for a queued or running job to finish and return the document's status"""
+        with self._lock:
+            future = self._futures.get(document_id)
+        if future is not None:
+            # Shielded so a waiter that goes away (e.g. a disconnected chat stream) doesn't
+            # cancel the job for everyone else waiting on it. asyncio.wait doesn't raise if
+            # the job itself was cancelled; its status says so.
+            await asyncio.wait([asyncio.shield(asyncio.wrap_future(future))])
+        return self.status(document_id)
+
+    def _run(self, document_id: str, upload: SavedUpload):
+        self._update(document_id, status='processing', started=time.time())
+        timings = RequestTimings()
+        try:
+            self.rag_manager.process_file(
+                upload.path, upload.file_name, upload.sha256,
+                on_progress=lambda chunks: self._update(document_id, chunks_indexed=chunks),
+                timings=timings
+            )
+            self._update(document_id, status='ready', finished=time.time(), timings=timings.summary())
+        except Exception as e:
+            print(f"Error indexing '{upload.file_name}': {e}")
+            self._update(document_id, status='failed', error=str(e), finished=time.time(),
+                         timings=timings.summary())
+        finally:
+            remove_upload(upload.path)
+            with self._lock:
+                job = self._jobs.get(document_id)
+                if job and job['started']:
+                    seconds = time.time() - job['started']
+                    self._job_seconds = seconds if self._job_seconds is None else 0.8 * self._job_seconds + 0.2 * seconds
+
+    def _on_done(self, document_id: str, upload: SavedUpload, future: Future):
+        """Forget a finished job's future, failing the job if it was cancelled before it ran, e.g. by an executor shutdown"""
+        with self._lock:
+            # The same file may have been submitted again since the job finished; keep the new future
+            if self._futures.get(document_id) is future:
+                del self._futures[document_id]
+            if not future.cancelled():
+                return
+            job = self._jobs.get(document_id)
+            if job and job['status'] == 'queued':
+                job.update(status='failed', error='Indexing was cancelled', finished=time.time())
+        remove_upload(upload.path)
+
+    def _update(self, document_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(document_id)
+            if job:
+                job.update(fields)
+
+    def _trim(self):
+        # Forget the oldest finished jobs; queued and running jobs are always kept
+        for document_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[document_id]['status'] in ('ready', 'failed'):
+                del self._jobs[document_id]
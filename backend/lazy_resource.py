@@ -0,0 +1,56 @@
+import threading
+import time
+
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class LazyResource(Generic[T]):
+    """Thread-safe holder that builds a heavy component on first use.
+
+    Loading happens at most once even when several requests need the component at
+    the same time; the others wait for the first load to finish.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def get(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    print(f"Loading {self.name}...")
+                    start = time.perf_counter()
+                    try:
+                        self._value = self._factory()
+                        self.error = None
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+                    self.load_seconds = time.perf_counter() - start
+                    print(f"Loaded {self.name} in {self.load_seconds:.2f}s")
+        return self._value
+
+    def warm_up(self):
+        """Load the component, logging instead of raising on failure"""
+        try:
+            self.get()
+        except Exception as e:
+            print(f"Error loading {self.name}: {e}")
+
+    def status(self) -> Dict:
+        return {
+            'loaded': self.loaded,
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import re
+import threading
+
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from config import settings
+
+# Words, plus identifiers such as error codes and part numbers kept whole (e.g. "e4012", "pn-88-x")
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms of a text; compound identifiers are indexed whole and by their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r'[-_./]', token) if part)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the chunks of one document.
+
+    Chunks are added in batches while a document is ingested, in the same order
+    as they are written to ChromaDB, and searched by chunk position.
+    """
+
+    def __init__(self, k1: float = settings.BM25_K1, b: float = settings.BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.chunk_ids: List[str] = []
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str]):
+        for chunk_id, text in zip(chunk_ids, texts):
+            position = len(self.chunk_ids)
+            terms = tokenize(text)
+            self.chunk_ids.append(chunk_id)
+            self.lengths.append(len(terms))
+            self._total_length += len(terms)
+            for term, frequency in Counter(terms).items():
+                self.postings.setdefault(term, []).append((position, frequency))
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return up to k (chunk id, score) pairs with a positive score, best first"""
+        if not self.chunk_ids:
+            return []
+        count = len(self.chunk_ids)
+        average_length = self._total_length / count or 1
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / average_length)
+                scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.chunk_ids[position], score) for position, score in best]
+
+    def to_dict(self) -> Dict:
+        return {'chunk_ids': self.chunk_ids, 'lengths': self.lengths, 'postings': self.postings}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BM25Index':
+        index = cls()
+        index.chunk_ids = data['chunk_ids']
+        index.lengths = data['lengths']
+        index.postings = {term: [tuple(posting) for posting in postings]
+                          for term, postings in data['postings'].items()}
+        index._total_length = sum(index.lengths)
+        return index
+
+
+class LexicalIndexRegistry:
+    """Keeps the BM25 indexes of recently used documents in memory and, optionally, on disk"""
+
+    def __init__(self,
+                 directory: Optional[str] = os.path.join(settings.CHROMA_PERSIST_DIRECTORY, 'bm25'),
+                 max_indexes: int = settings.BM25_MAX_INDEXES):
+        self.directory = directory
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, doc_hash: str) -> str:
+        return os.path.join(self.directory, f"{doc_hash}.json")
+
+    def get(self, doc_hash: str) -> Optional[BM25Index]:
+        """Get a document's index from memory or disk, or None if it has none"""
+        with self._lock:
+            index = self._indexes.get(doc_hash)
+            if index is not None:
+                self._indexes.move_to_end(doc_hash)
+                return index
+        if self.directory is None or not os.path.exists(self._path(doc_hash)):
+            return None
+        try:
+            with open(self._path(doc_hash), 'r', encoding='utf-8') as f:
+                index = BM25Index.from_dict(json.load(f))
+        except Exception as e:
+            print(f"Error loading BM25 index for document {doc_hash[:12]}: {e}")
+            return None
+        self._remember(doc_hash, index)
+        return index
+
+    def put(self, doc_hash: str, index: BM25Index):
+        """Register a freshly built index and save it next to the vector store"""
+        self._remember(doc_hash, index)
+        if self.directory is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(doc_hash)}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index.to_dict(), f)
+            os.replace(tmp_path, self._path(doc_hash))
+        except Exception as e:
+            print(f"Error saving BM25 index for document {doc_hash[:12]}: {e}")
+
+    def build(self, doc_hash: str, chunks: Iterable[Tuple[str, str]]) -> BM25Index:
+        """Build and register an index from (chunk id, text) pairs, e.g. for documents indexed before BM25"""
+        index = BM25Index()
+        for chunk_id, text in chunks:
+            index.add([chunk_id], [text])
+        self.put(doc_hash, index)
+        return index
+
+    def drop(self, doc_hash: str):
+        with self._lock:
+            self._indexes.pop(doc_hash, None)
+        if self.directory is not None:
+            try:
+                os.remove(self._path(doc_hash))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, doc_hash: str, index: BM25Index):
+        with self._lock:
+            self._indexes[doc_hash] = index
+            self._indexes.move_to_end(doc_hash)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = settings.RRF_K) -> List[str]:
+    """Merge ranked lists of ids, scoring each id by the sum of 1 / (k + rank) over the lists"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1 / (k + rank)
+    return sorted(scores, key=lambda item: scores[item], reverse=True)
@@ -1,14 +1,21 @@
-from typing import Optional
-from fastapi import FastAPI, File, Form, UploadFile
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from pydantic import BaseModel
-from starlette.responses import StreamingResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
+from admission import QueueFullError
 from ollama_service import OllamaService
 from config import settings
+from metrics import METRICS_CONTENT_TYPE, render_metrics
+from upload_utils import save_upload
 
 class ChatRequest(BaseModel):
     query: str
     model: Optional[str] = None
+    include_timings: Optional[bool] = False
+    session_id: Optional[str] = None
+    stream_format: Literal['default', 'compact'] = 'default'
 
 
 class ChatWithContextRequest(BaseModel):
@@ -16,10 +23,19 @@ class ChatWithContextRequest(BaseModel):
     search_internet: Optional[bool] = False
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.WARMUP_ON_STARTUP:
+        ai_service.start_warm_up()
+    yield
+    await ai_service.close()
+
+
 version = "v1"
 app = FastAPI(version=version,
               title='II-Chatbot API',
-              description='API for II-Chatbot that utilize FastAPI and Ollama')
+              description='API for II-Chatbot that utilize FastAPI and Ollama',
+              lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -34,12 +50,49 @@ app.add_middleware(
 ai_service = OllamaService()
 
 
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request, exc: QueueFullError):
+    """Reject requests quickly when a stage is saturated instead of letting them time out"""
+    return JSONResponse(status_code=429, content={"detail": str(exc), "stage": exc.stage},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
 @app.get("/models")
 async def get_available_models():
     """Get a list of available Ollama models"""
     return {"models": settings.AVAILABLE_MODELS}
 
 
+@app.get("/models/status")
+async def get_model_status():
+    """Get the keep-alive and context settings of each model and whether Ollama has it loaded"""
+    return await ai_service.get_model_status()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Export per-stage latency histograms in the Prometheus text format"""
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/ready")
+async def get_readiness():
+    """Report which models are loaded; plain chat works before warm-up completes"""
+    return ai_service.get_readiness()
+
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """Get the concurrency limits and active/waiting requests for generation and retrieval"""
+    return ai_service.get_admission_stats()
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Get statistics for the document ingestion and web search caches"""
+    return ai_service.get_cache_stats()
+
+
 @app.post("/chat/stream")
 async def chat_stream(request: ChatRequest):
     print("Request received for /chat/stream")
@@ -48,37 +101,92 @@ async def chat_stream(request: ChatRequest):
     # Use model from request body or default from settings
     model_to_use = request.model if request.model in settings.AVAILABLE_MODELS else settings.OLLAMA_MODEL
     print("Using model:", model_to_use)
-    return StreamingResponse(ai_service.get_chat_stream(request.query, model=model_to_use),
+    ai_service.check_admission(model_to_use)
+    return StreamingResponse(ai_service.get_chat_stream(request.query, model=model_to_use,
+                                                        include_timings=request.include_timings,
+                                                        session_id=request.session_id,
+                                                        stream_format=request.stream_format),
                              media_type="text/event-stream")
 
 
+@app.post("/conversations", status_code=201)
+async def create_conversation():
+    """Start a chat session; pass its session_id with chat requests to keep context between turns"""
+    return {"session_id": ai_service.create_conversation()}
+
+
+@app.get("/conversations/{session_id}")
+async def get_conversation(session_id: str):
+    """Get the turns stored for a chat session"""
+    conversation = ai_service.get_conversation(session_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+
+@app.delete("/conversations/{session_id}", status_code=204)
+async def delete_conversation(session_id: str):
+    """Forget a chat session"""
+    if not ai_service.delete_conversation(session_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+
+@app.post("/documents", status_code=202)
+async def upload_document(file: UploadFile = File(...)):
+    """Upload a document for background indexing and return its document ID right away"""
+    # Stream the upload to disk instead of holding it in memory
+    upload = await save_upload(file)
+    return ai_service.submit_document(upload)
+
+
+@app.get("/documents/{document_id}")
+async def get_document_status(document_id: str):
+    """Get the indexing status and progress of an uploaded document"""
+    status = ai_service.get_document_status(document_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return status
+
+
 @app.post("/chat/stream-with-context")
 async def chat_stream_with_context(
     query: str = Form(...),
     search_internet: bool = Form(False),
+    deep_search: bool = Form(False),
     model: Optional[str] = Form(None),
+    document_id: Optional[str] = Form(None),
+    include_timings: bool = Form(False),
+    session_id: Optional[str] = Form(None),
+    stream_format: Literal['default', 'compact'] = Form('default'),
     file: Optional[UploadFile] = File(None)
 ):
-    """Stream chat responses with context from file and/or web search"""
-    file_bytes = None
-    file_name = None
-    
-    # Process file if uploaded
-    if file:
-        file_bytes = await file.read()
-        file_name = file.filename
-    
+    """Stream chat responses with context from a document and/or web search
+
+    With deep_search, the top search result pages are read rather than just their snippets.
+    Pass the document_id returned by /documents, or attach the file directly to have
+    it indexed first. Either way the first event carries the document_id, so an attachment
+    that is still being indexed after DOCUMENT_WAIT_DEADLINE_MS can be asked about again later.
+    """
     # Use specified model or default from settings
     model_to_use = model if model in settings.AVAILABLE_MODELS else settings.OLLAMA_MODEL
     print("Stream with context using model:", model_to_use)
+    # Reject before reading the upload if the model's queue is already full
+    ai_service.check_admission(model_to_use)
+    
+    if file:
+        upload = await save_upload(file)
+        document_id = ai_service.submit_document(upload)['document_id']
     
     return StreamingResponse(
         ai_service.get_context_enhanced_chat_stream(
             query=query,
-            file_bytes=file_bytes,
-            file_name=file_name,
+            document_id=document_id,
             search_internet=search_internet,
-            model=model_to_use
+            deep_search=deep_search,
+            model=model_to_use,
+            include_timings=include_timings,
+            session_id=session_id,
+            stream_format=stream_format
         ),
         media_type="text/event-stream"
     )
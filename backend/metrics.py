@@ -0,0 +1,81 @@
+import time
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+STAGE_SECONDS = Histogram(
+    'ii_chatbot_stage_seconds',
+    'Latency of each stage of the chat and ingestion pipelines',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    'ii_chatbot_time_to_first_token_seconds',
+    'Time from sending a chat request to Ollama until the first token arrives',
+    ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60)
+)
+TOKENS_PER_SECOND = Histogram(
+    'ii_chatbot_tokens_per_second',
+    'Ollama generation throughput per response',
+    ['model'],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200)
+)
+
+ANSWER_CACHE_LOOKUPS = Counter(
+    'ii_chatbot_answer_cache_lookups',
+    'Answer cache lookups by outcome',
+    ['outcome']
+)
+
+
+class RequestTimings:
+    """Per-request stage durations, also recorded in the Prometheus stage histogram"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def record(self, stage: str, seconds: float):
+        # Stages that run several times per request (e.g. per embedding batch) are summed
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def summary(self) -> Dict[str, float]:
+        """Stage durations in milliseconds, plus the total time so far"""
+        summary = {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()}
+        summary['total'] = round((time.perf_counter() - self.start) * 1000, 2)
+        return summary
+
+
+def record_stage(stage: str, seconds: float, timings: Optional[RequestTimings] = None):
+    """Record a stage duration in the stage histogram and, if given, the request's timings"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if timings is not None:
+        timings.record(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Optional[RequestTimings] = None) -> Iterator[None]:
+    """Time a block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, timings)
+
+
+def observe_generation(model: str, first_token_seconds: Optional[float],
+                       eval_count: Optional[int], eval_seconds: Optional[float]):
+    """Record time to first token and tokens per second for one Ollama response"""
+    if first_token_seconds is not None:
+        TIME_TO_FIRST_TOKEN_SECONDS.labels(model).observe(first_token_seconds)
+    if eval_count and eval_seconds:
+        TOKENS_PER_SECOND.labels(model).observe(eval_count / eval_seconds)
+
+
+def render_metrics() -> bytes:
+    return generate_latest()
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from typing import Dict, List, Optional, Union
+from ollama import AsyncClient
+from config import settings
+
+
+class ModelManager:
+    """Keeps the configured Ollama models loaded and tracks which ones are resident.
+
+    Every request for a model is sent with the same `keep_alive` and `num_ctx`;
+    a different `num_ctx` makes Ollama reload the model, and a missing
+    `keep_alive` lets it unload the model after five idle minutes. Models in
+    OLLAMA_PRELOAD_MODELS are loaded at startup so the first request doesn't pay
+    for the load.
+    """
+
+    def __init__(self, client: AsyncClient,
+                 preload_models: Optional[List[str]] = None,
+                 ps_ttl: float = 5.0):
+        self._client = client
+        self.preload_models = preload_models if preload_models is not None else settings.OLLAMA_PRELOAD_MODELS
+        self._ps_ttl = ps_ttl
+        self._preloads: Dict[str, Dict] = {}
+        self._resident: List[Dict] = []
+        self._resident_checked = 0.0
+        self._preload_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def keep_alive(model: str) -> Union[str, int]:
+        return settings.MODEL_KEEP_ALIVE.get(model, settings.OLLAMA_KEEP_ALIVE)
+
+    @staticmethod
+    def options(model: str) -> Dict:
+        return {'num_ctx': settings.MODEL_NUM_CTX.get(model, settings.OLLAMA_NUM_CTX)}
+
+    def request_args(self, model: str) -> Dict:
+        """Keyword arguments to pass with every chat or generate call for a model"""
+        return {'keep_alive': self.keep_alive(model), 'options': self.options(model)}
+
+    def start_preload(self):
+        """Load the preload models in the background; must be called from the event loop"""
+        if self.preload_models and self._preload_task is None:
+            self._preload_task = asyncio.create_task(self.preload_all())
+
+    async def preload_all(self):
+        # One at a time, so two large models don't compete for memory while loading
+        for model in self.preload_models:
+            await self.preload(model)
+
+    async def preload(self, model: str) -> Dict:
+        """Load a model into memory without generating anything"""
+        self._preloads[model] = {'status': 'loading', 'load_seconds': None, 'error': None}
+        print(f"Preloading Ollama model {model}...")
+        start = time.perf_counter()
+        try:
+            # A generate call without a prompt only loads the model
+            await self._client.generate(model=model, **self.request_args(model))
+            self._preloads[model] = {'status': 'loaded', 'load_seconds': time.perf_counter() - start, 'error': None}
+            print(f"Preloaded Ollama model {model} in {self._preloads[model]['load_seconds']:.2f}s")
+        except Exception as e:
+            self._preloads[model] = {'status': 'failed', 'load_seconds': None, 'error': str(e)}
+            print(f"Error preloading Ollama model {model}: {e}")
+        self._resident_checked = 0.0
+        return dict(self._preloads[model])
+
+    async def resident_models(self) -> List[Dict]:
+        """Models Ollama currently holds in memory, refreshed at most every few seconds"""
+        if time.monotonic() - self._resident_checked > self._ps_ttl:
+            response = await self._client.ps()
+            self._resident = [{
+                'model': model.model,
+                'size': model.size,
+                'size_vram': model.size_vram,
+                'expires_at': model.expires_at.isoformat() if model.expires_at else None,
+            } for model in response.models]
+            self._resident_checked = time.monotonic()
+        return [dict(model) for model in self._resident]
+
+    def preload_status(self) -> Dict:
+        return {model: dict(self._preloads.get(model, {'status': 'pending'})) for model in self.preload_models}
+
+    async def status(self) -> Dict:
+        """Configured options, preload state and residency of every available model"""
+        try:
+            resident = {model['model']: model for model in await self.resident_models()}
+            error = None
+        except Exception as e:
+            resident = {}
+            error = str(e)
+        models = {}
+        for model in dict.fromkeys(settings.AVAILABLE_MODELS + self.preload_models):
+            models[model] = {
+                'keep_alive': self.keep_alive(model),
+                'num_ctx': self.options(model)['num_ctx'],
+                'preload': self.preload_status().get(model),
+                'resident': resident.get(model),
+            }
+        return {'models': models, 'error': error}
+
+    def close(self):
+        if self._preload_task is not None and not self._preload_task.done():
+            self._preload_task.cancel()
@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import threading
+
+import pytesseract
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterator, List, Optional, Sequence, Tuple
+from pdf2image import convert_from_path, pdfinfo_from_path
+from config import settings
+
+# This module is imported by the OCR worker processes, so keep its imports light
+
+
+def _init_worker():
+    # Parallelism comes from the pool; stop tesseract from oversubscribing cores with OpenMP
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def _contiguous_runs(pages: Sequence[int]) -> Iterator[Tuple[int, int]]:
+    """Group sorted zero-based page indices into (first, last) runs"""
+    first = last = pages[0]
+    for page in pages[1:]:
+        if page != last + 1:
+            yield first, last
+            first = page
+        last = page
+    yield first, last
+
+
+def ocr_pages(file_path: str, pages: Sequence[int], dpi: int) -> List[str]:
+    """Rasterize and OCR a batch of pages, returning their text in page order"""
+    texts = []
+    for first, last in _contiguous_runs(pages):
+        for image in convert_from_path(file_path, dpi=dpi, first_page=first + 1, last_page=last + 1):
+            texts.append(pytesseract.image_to_string(image))
+            image.close()
+    return texts
+
+
+class OCRPool:
+    """Process pool that OCRs PDF pages in parallel batches.
+
+    Each task rasterizes at most `batch_pages` pages, so memory stays bounded no
+    matter how long the document is, and results are merged back in page order.
+    """
+
+    def __init__(self,
+                 workers: int = settings.OCR_WORKERS,
+                 batch_pages: int = settings.OCR_BATCH_PAGES,
+                 dpi: int = settings.OCR_DPI):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_pages = batch_pages
+        self.dpi = dpi
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def ocr(self, file_path: str, pages: Optional[Sequence[int]] = None) -> List[str]:
+        """OCR the given zero-based pages (all pages by default) and return their text in order"""
+        if pages is None:
+            pages = range(pdfinfo_from_path(file_path)['Pages'])
+        pages = sorted(pages)
+        if not pages:
+            return []
+
+        batches = [pages[i:i + self.batch_pages] for i in range(0, len(pages), self.batch_pages)]
+        texts = []
+        for batch_texts in self._get_executor().map(ocr_pages, repeat(file_path), batches, repeat(self.dpi)):
+            texts.extend(batch_texts)
+        return texts
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Spawn rather than fork so workers don't inherit the embedding model and torch threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+            return self._executor
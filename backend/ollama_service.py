@@ -1,109 +1,537 @@
-import json
+import asyncio
+import functools
+import threading
+import time
 
-from typing import Optional, List
-from ollama import Client
+import httpx
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional, Union
+from ollama import AsyncClient
+from admission import AdmissionController, QueueFullError
+from answer_cache import AnswerCache, context_fingerprint
 from config import settings
-from rag_utils import RAGManager
+from conversation import ConversationStore, build_chat_messages
+from ingestion_jobs import IngestionJobManager
+from model_manager import ModelManager
+from metrics import RequestTimings, observe_generation, record_stage, stage_timer
+from rag_utils import RAGManager, embedding_model, embeddings
+from search_cache import search_cache
+from sse import coalesce_tokens, format_compact_event, format_event
+from token_budget import warm_up_tokenizers
+from upload_utils import SavedUpload
+from web_fetch import WebPageFetcher
 from web_search_google import WebSearchGoogleManager
 
+# Kept identical across requests so Ollama can reuse the evaluated prompt prefix
+CONTEXT_INSTRUCTIONS = "You are a helpful AI assistant. Use the information provided with the user's question to answer it, but don't explicitly mention that you're using this information unless asked. If the information doesn't contain the answer, just say you don't know and respond based on your training."
+
+
 class OllamaService:
     def __init__(self,
                  address: str = f'{settings.OLLAMA_HOST}:{settings.OLLAMA_PORT}'):
         self._address = address
+        self._model = settings.OLLAMA_MODEL
+        self._warm_up_complete = False
         self.rag_manager = RAGManager()
         self.web_search_google_manager = WebSearchGoogleManager()
+        
+        # One connection pool is shared by every stream. ollama.AsyncClient builds its own httpx
+        # client, so the service owns the transport that holds the pool and closes it on shutdown
+        self._ollama_transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.OLLAMA_MAX_CONNECTIONS)
+        )
+        self._client = AsyncClient(host=self._address, transport=self._ollama_transport)
+        
+        self.model_manager = ModelManager(self._client)
+        
+        # Blocking CPU work runs on dedicated executors so it never stalls the event loop
+        self._ingestion_executor = ThreadPoolExecutor(max_workers=settings.INGESTION_WORKERS,
+                                                      thread_name_prefix='ingestion')
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=settings.RETRIEVAL_WORKERS,
+                                                      thread_name_prefix='retrieval')
+        
+        # Result pages for deep web search are fetched over their own pooled client
+        self.web_page_fetcher = WebPageFetcher(self._retrieval_executor)
+        
+        # Documents are indexed in the background, separately from chat requests
+        self.ingestion_jobs = IngestionJobManager(self.rag_manager, self._ingestion_executor)
+        self.conversations = ConversationStore()
+        
+        # Limits how many requests generate or retrieve at once; the rest wait in line
+        self.admission = AdmissionController()
+        
+        # Answers to repeated questions about the same context are replayed instead of generated
+        self.answer_cache = AnswerCache()
 
-    def get_chat_stream(self, query: str, model: str = None):
-        client = Client(host=self._address)
-        chat_messages: list[dict[str, str]] = [{'role': 'user', 'content': query}]
-
-        stream = client.chat(model=model, messages=chat_messages, stream=True)
+    def start_warm_up(self):
+        """Load the heavy models in the background so the server can accept traffic right away"""
+        threading.Thread(target=self._warm_up, name='warm-up', daemon=True).start()
+        self.model_manager.start_preload()
+    
+    def _warm_up(self):
+        self.rag_manager.warm_up()
+        warm_up_tokenizers()
+        if self.web_search_google_manager.api_key:
+            self.web_search_google_manager.service_client.warm_up()
+        self._warm_up_complete = True
+        print("Warm-up complete")
+    
+    def get_readiness(self) -> dict:
+        """Report which heavy components are loaded"""
+        return {
+            'warm_up_complete': self._warm_up_complete,
+            'components': {
+                'embedding_model': embedding_model.status(),
+                'reranker': self.rag_manager.reranker_model.status(),
+                'google_search': self.web_search_google_manager.service_client.status(),
+                'ollama_models': self.model_manager.preload_status()
+            }
+        }
+    
+    async def get_model_status(self) -> dict:
+        """Report the keep-alive settings and residency of the Ollama models"""
+        return await self.model_manager.status()
+    
+    async def close(self):
+        """Close the pooled Ollama and web connections and shut down the executors and OCR workers"""
+        self.model_manager.close()
+        await self._ollama_transport.aclose()
+        await self.web_page_fetcher.close()
+        self._ingestion_executor.shutdown(wait=False, cancel_futures=True)
+        self._retrieval_executor.shutdown(wait=False, cancel_futures=True)
+        self.rag_manager.close()
 
-        for chunk in stream:
+    async def _chat_tokens(self, model: str, messages: list[dict[str, str]],
+                           timings: Optional[RequestTimings] = None) -> AsyncIterator[str]:
+        """Stream message content from Ollama, recording time to first token and throughput"""
+        start = time.perf_counter()
+        first_token_seconds = None
+        eval_count = eval_duration = None
+        
+        stream = await self._client.chat(model=model, messages=messages, stream=True,
+                                         **self.model_manager.request_args(model))
+        
+        async for chunk in stream:
             if 'message' in chunk and 'content' in chunk['message']:
-                content = {'content': chunk['message']['content']}
-                yield f"data: {json.dumps(content)}\n\n"
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - start
+                    if timings is not None:
+                        timings.record('time_to_first_token', first_token_seconds)
+                yield chunk['message']['content']
+            if chunk.get('done'):
+                eval_count = chunk.get('eval_count')
+                eval_duration = chunk.get('eval_duration')
+        
+        record_stage('generation', time.perf_counter() - start, timings)
+        # Ollama reports eval_duration in nanoseconds
+        observe_generation(model, first_token_seconds, eval_count, eval_duration / 1e9 if eval_duration else None)
     
-    def process_file(self, file_bytes: bytes, file_name: str) -> List[str]:
-        """Process a file and extract its contents"""
-        return self.rag_manager.process_file(file_bytes, file_name)
+    @staticmethod
+    async def _content_events(tokens: AsyncIterator[str], answer: list, compact: bool,
+                              token_fields: Optional[dict] = None) -> AsyncIterator[Union[str, bytes]]:
+        """Frame streamed tokens as SSE events, collecting the full answer in `answer`
+
+        The default format sends one event per token with `token_fields` repeated in
+        each. The compact format sends coalesced pieces of text with nothing else.
+        """
+        if compact:
+            async for piece in coalesce_tokens(tokens):
+                answer.append(piece)
+                yield format_compact_event({'content': piece})
+        else:
+            async for token in tokens:
+                answer.append(token)
+                yield format_event({'content': token, **(token_fields or {})})
     
-    def get_context_enhanced_chat_stream(self, query: str, file_bytes: Optional[bytes] = None, 
-                                        file_name: Optional[str] = None, search_internet: bool = False,
-                                        model: str = None):
-        client = Client(host=self._address)
+    async def _admitted_content_events(self, model: str, tokens: AsyncIterator[str], answer: list, compact: bool,
+                                       token_fields: Optional[dict] = None,
+                                       timings: Optional[RequestTimings] = None) -> AsyncIterator[Union[str, bytes]]:
+        """Wait for a generation slot for the model, reporting the queue position, then stream the tokens"""
+        try:
+            ticket = self.admission.generation(model).enter()
+        except QueueFullError as e:
+            error = {'content': '', 'error': str(e), 'retry_after': e.retry_after}
+            yield format_compact_event(error) if compact else format_event(error)
+            return
         
-        # Build context from file and/or web search
-        context_parts = []
-        search_sources = []
+        try:
+            with stage_timer('queue_wait', timings):
+                async for position in ticket.positions():
+                    event = {'content': '', 'queue_position': position}
+                    yield format_compact_event(event) if compact else format_event(event)
+            async for event in self._content_events(tokens, answer, compact, token_fields):
+                yield event
+        finally:
+            ticket.release()
+    
+    async def _build_chat_messages(self, timings: Optional[RequestTimings], *args, **kwargs) -> list[dict[str, str]]:
+        """Assemble the prompt on the retrieval executor; token counting and tokenizer loading would block the loop"""
+        with stage_timer('prompt_assembly', timings):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._retrieval_executor, functools.partial(build_chat_messages, *args, **kwargs)
+            )
+    
+    async def _retrieve(self, func, timings: Optional[RequestTimings] = None, **kwargs):
+        """Run a retrieval function on the retrieval executor once the retrieval gate admits it"""
+        ticket = self.admission.retrieval.enter()
+        try:
+            with stage_timer('retrieval_wait', timings):
+                await ticket.wait()
+            future = asyncio.get_running_loop().run_in_executor(
+                self._retrieval_executor, functools.partial(func, timings=timings, **kwargs)
+            )
+        except BaseException:
+            ticket.release()
+            raise
+        # The slot is held until the work finishes, even if the caller stops waiting at a deadline
+        future.add_done_callback(lambda _: ticket.release())
+        return await asyncio.shield(future)
+    
+    async def _deep_web_context(self, query: str, results: list, timings: Optional[RequestTimings] = None) -> Optional[str]:
+        """Build web context from the most relevant chunks of the top result pages"""
+        urls = [result['link'] for result in results[:settings.WEB_FETCH_MAX_PAGES] if result.get('link')]
+        pages = await self.web_page_fetcher.fetch(urls, timings)
+        if not pages:
+            return None
+        chunks = await self._retrieve(
+            self.rag_manager.select_web_context,
+            query=query,
+            pages=pages,
+            top_k=settings.WEB_CONTEXT_TOP_K,
+            use_mmr=settings.MMR_ENABLED,
+            use_reranking=settings.RERANKING_ENABLED,
+            lambda_mult=settings.MMR_LAMBDA_MULT,
+            timings=timings
+        )
+        return self.web_search_google_manager.format_page_context(chunks) if chunks else None
+    
+    async def _document_context(self, query: str, document_id: str,
+                                timings: Optional[RequestTimings] = None) -> dict:
+        """Wait for a document to be indexed, then retrieve its context for the query
+
+        Waiting for indexing is abandoned after DOCUMENT_WAIT_DEADLINE_MS, leaving the job
+        to finish in the background, and retrieval after DOCUMENT_CONTEXT_DEADLINE_MS.
+
+        Returns:
+            The status ('included', 'empty', 'failed', 'pending' or 'timed_out') and context to add to the prompt
+        """
+        try:
+            with stage_timer('document_wait', timings):
+                document = await asyncio.wait_for(self.ingestion_jobs.wait(document_id),
+                                                  settings.DOCUMENT_WAIT_DEADLINE_MS / 1000)
+        except asyncio.TimeoutError:
+            print(f"Document {document_id[:12]} is still being indexed after {settings.DOCUMENT_WAIT_DEADLINE_MS}ms")
+            return {'status': 'pending', 'context': None}
         
-        # Process attached file if any
-        if file_bytes and file_name:
-            try:
-                # Process the file and create vector DB
-                self.process_file(file_bytes, file_name)
-                
-                # Get relevant context for the query using MMR and reranking if enabled
-                file_context = self.rag_manager.get_relevant_context(
+        try:
+            if document is None:
+                raise ValueError(f"Unknown document: {document_id}")
+            if document['status'] == 'failed':
+                raise ValueError(document['error'])
+            
+            # Get relevant context for the query using MMR and reranking if enabled
+            file_context = await asyncio.wait_for(
+                self._retrieve(
+                    self.rag_manager.get_relevant_context,
                     query=query,
+                    document_id=document_id,
                     use_mmr=settings.MMR_ENABLED,
                     use_reranking=settings.RERANKING_ENABLED,
                     top_k=settings.MMR_TOP_K,
                     fetch_k=settings.MMR_FETCH_K,
-                    lambda_mult=settings.MMR_LAMBDA_MULT
-                )
-                if file_context:
-                    context_parts.append(f"Information from file '{file_name}':\n{file_context}")
-            except Exception as e:
-                print(f"Error processing file: {e}")
-                context_parts.append(f"Error analyzing file: {str(e)}")
+                    lambda_mult=settings.MMR_LAMBDA_MULT,
+                    use_hybrid=settings.HYBRID_SEARCH_ENABLED,
+                    timings=timings
+                ),
+                settings.DOCUMENT_CONTEXT_DEADLINE_MS / 1000
+            )
+        except asyncio.TimeoutError:
+            print(f"Document retrieval missed its {settings.DOCUMENT_CONTEXT_DEADLINE_MS}ms deadline")
+            return {'status': 'timed_out', 'context': None}
+        except Exception as e:
+            print(f"Error processing file: {e}")
+            return {'status': 'failed', 'context': f"Error analyzing file: {str(e)}"}
+        
+        if not file_context:
+            return {'status': 'empty', 'context': None}
+        return {'status': 'included', 'context': f"Information from file '{document['file_name']}':\n{file_context}"}
+    
+    async def _web_search(self, query: str, timings: Optional[RequestTimings] = None) -> list:
+        """Search the web once; the same results feed the sources and the model context"""
+        with stage_timer('web_search', timings):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._retrieval_executor, self.web_search_google_manager.search, query
+            )
+    
+    async def _web_context(self, query: str, search_task: asyncio.Task, deep_search: bool, deadline: float,
+                           timings: Optional[RequestTimings] = None) -> dict:
+        """Build web context from a running search by the deadline (in event loop time)
+
+        A search that misses the deadline leaves the request without web context. Reading
+        the result pages is abandoned at the deadline in favor of the snippets.
+
+        Returns:
+            The status ('included', 'empty', 'failed' or 'timed_out'), the context to add to
+            the prompt and the search results
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            results = await asyncio.wait_for(asyncio.shield(search_task), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            print(f"Web search missed its {settings.WEB_CONTEXT_DEADLINE_MS}ms deadline")
+            return {'status': 'timed_out', 'context': None, 'results': []}
+        except Exception as e:
+            print(f"Error during web search: {e}")
+            return {'status': 'failed', 'context': "Error retrieving information from the web.", 'results': []}
         
-        # Perform web search if enabled
-        if search_internet:
+        # Read the result pages themselves if asked to, falling back to the snippets
+        web_context = None
+        if deep_search and results:
             try:
-                # Get raw search results to extract sources
-                raw_results = self.web_search_google_manager.search(query)
-                for result in raw_results:
-                    # Store source information to send with the response
-                    search_sources.append({
-                        'title': result.get('title', 'Untitled'),
-                        'link': result.get('link', '#')
-                    })
-                
-                # Get formatted context for the model
-                web_context = self.web_search_google_manager.get_search_context(query)
-                if web_context:
-                    context_parts.append(f"Information from web search:\n{web_context}")
+                web_context = await asyncio.wait_for(self._deep_web_context(query, results, timings),
+                                                     max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                print("Reading web pages missed the deadline, using the search snippets")
             except Exception as e:
-                print(f"Error during web search: {e}")
-                context_parts.append("Error retrieving information from the web.")
+                print(f"Error reading web pages: {e}")
         
-        # Build the system prompt with context
-        system_prompt = ""
-        if context_parts:
-            combined_context = "\n\n".join(context_parts)
-            system_prompt = f"""You are a helpful AI assistant. Use the following information to answer the user's question, but don't explicitly mention that you're using this information unless asked. If the information doesn't contain the answer, just say you don't know and respond based on your training.
+        # Get formatted context for the model
+        if not web_context:
+            web_context = self.web_search_google_manager.format_search_context(results)
+        return {'status': 'included' if results else 'empty',
+                'context': f"Information from web search:\n{web_context}",
+                'results': results}
+    
+    @staticmethod
+    def _context_header(model: str, compact: bool, context_sources: dict, document_id: Optional[str],
+                        search_sources: list, cached: bool = False) -> Optional[Union[str, bytes]]:
+        """The first event of a context stream, or None if the default format has nothing to report
+
+        The compact header carries everything that doesn't change during the stream. The
+        default format sends the context status, and the sources if there are search
+        results, in the first chunk. The document_id lets the client poll an attached
+        file's indexing and ask again once it's ready.
+        """
+        if not compact and not context_sources:
+            return None
+        header = {'content': '', 'model': model}
+        if context_sources:
+            header['context_sources'] = context_sources
+        if document_id:
+            header['document_id'] = document_id
+        if search_sources:
+            header['search_sources'] = search_sources
+        if compact and cached:
+            header['cached'] = True
+        return format_compact_event(header) if compact else format_event(header)
+    
+    @staticmethod
+    def _search_sources(results: list) -> list:
+        """Source information to send with the response"""
+        return [{'title': result.get('title', 'Untitled'), 'link': result.get('link', '#')} for result in results]
+    
+    def check_admission(self, model: str = None):
+        """Raise QueueFullError if a chat request for the model would have to be rejected"""
+        self.admission.generation(model or self._model).check()
+    
+    async def get_chat_stream(self, query: str, model: str = None, include_timings: bool = False,
+                              session_id: Optional[str] = None,
+                              stream_format: str = 'default') -> AsyncIterator[Union[str, bytes]]:
+        """Stream a chat response
 
-{combined_context}"""
+        With stream_format='compact', a header event carries the model and tokens are
+        coalesced into fewer, smaller events.
+        """
+        timings = RequestTimings()
+        compact = stream_format == 'compact'
+        model = model or self._model
+        session = self.conversations.get(session_id) if session_id else None
+        chat_messages = await self._build_chat_messages(timings, model, query, session=session)
+
+        if compact:
+            yield format_compact_event({'content': '', 'model': model})
         
-        # Build chat messages
-        chat_messages = []
-        if system_prompt:
-            chat_messages.append({'role': 'system', 'content': system_prompt})
-        chat_messages.append({'role': 'user', 'content': query})
+        answer = []
+        tokens = self._chat_tokens(model, chat_messages, timings)
+        async for event in self._admitted_content_events(model, tokens, answer, compact, timings=timings):
+            yield event
         
-        # Get response from Ollama
-        # Use provided model or default to the instance model
+        # A stream rejected by admission control produced no answer and isn't a turn
+        if session_id and answer:
+            self.conversations.append(session_id, query, "".join(answer))
+        
+        if include_timings:
+            trailer = {'content': '', 'timings': timings.summary()}
+            yield format_compact_event(trailer) if compact else format_event(trailer)
+    
+    def submit_document(self, upload: SavedUpload) -> dict:
+        """Queue an uploaded file for background indexing and return its job status"""
+        return self.ingestion_jobs.submit(upload)
+    
+    def get_document_status(self, document_id: str) -> Optional[dict]:
+        """Get the indexing status of a document"""
+        return self.ingestion_jobs.status(document_id)
+    
+    def get_admission_stats(self) -> dict:
+        """Get active and waiting request counts for each admission gate"""
+        return dict(self.admission.stats(), ingestion_queue_size=self.ingestion_jobs.max_queued)
+    
+    def create_conversation(self) -> str:
+        """Start a chat session and return its ID"""
+        return self.conversations.create()
+    
+    def get_conversation(self, session_id: str) -> Optional[dict]:
+        """Get the stored turns of a chat session"""
+        return self.conversations.get(session_id)
+    
+    def delete_conversation(self, session_id: str) -> bool:
+        """Forget a chat session"""
+        return self.conversations.delete(session_id)
+    
+    def get_cache_stats(self) -> dict:
+        """Get hit/miss and size statistics for the service caches"""
+        return {
+            'documents': self.rag_manager.document_cache.stats(),
+            'collections': self.rag_manager.collections.stats(),
+            'search': search_cache.stats(),
+            'web_pages': self.web_page_fetcher.stats(),
+            'rerank': self.rag_manager.reranking_service.stats(),
+            'answers': self.answer_cache.stats(),
+            'conversations': self.conversations.stats()
+        }
+    
+    async def get_context_enhanced_chat_stream(self, query: str, document_id: Optional[str] = None,
+                                               search_internet: bool = False,
+                                               deep_search: bool = False,
+                                               model: str = None,
+                                               include_timings: bool = False,
+                                               session_id: Optional[str] = None,
+                                               stream_format: str = 'default') -> AsyncIterator[Union[str, bytes]]:
+        """Stream a chat response with context from an indexed document and/or web search
+
+        Document retrieval and web search run concurrently. If the document is still being
+        indexed, the stream waits for its job to finish up to a deadline. Sources that miss
+        their deadlines are left out, and the first event reports each source's status
+        along with the document_id, which identifies an attached file once it is indexed.
+        With deep_search, the top result pages are fetched and their most relevant
+        chunks are used instead of the search snippets.
+        With a session_id, earlier turns of the conversation are included within the
+        model's prompt budget and the answer is added to the session.
+        With the answer cache enabled, a question similar to an earlier one about the same
+        document and search results is answered from the cache without generating.
+        With include_timings, a final event reports how long each stage took.
+        With stream_format='compact', the model and sources are sent once in a header
+        event and tokens are coalesced into fewer, smaller events.
+        """
+        loop = asyncio.get_running_loop()
+        compact = stream_format == 'compact'
+        timings = RequestTimings()
         model_to_use = model if model else self._model
-        stream = client.chat(model=model_to_use, messages=chat_messages, stream=True)
+        session = self.conversations.get(session_id) if session_id else None
+        # Answers built on earlier turns are never cached
+        cacheable = settings.ANSWER_CACHE_ENABLED and not (session and session['turns'])
         
-        # Send sources in the first chunk if we have search results
-        if search_internet and search_sources:
-            first_chunk = {'content': '', 'search_sources': search_sources, 'model': model_to_use}
-            yield f"data: {json.dumps(first_chunk)}\n\n"
+        # Fetch the document and web context concurrently, each within its own deadline
+        web_deadline = loop.time() + settings.WEB_CONTEXT_DEADLINE_MS / 1000
+        search_task = asyncio.create_task(self._web_search(query, timings)) if search_internet else None
+        document_task = asyncio.create_task(self._document_context(query, document_id, timings)) if document_id else None
         
-        for chunk in stream:
-            if 'message' in chunk and 'content' in chunk['message']:
-                # For regular content chunks, just send the content
-                content = {'content': chunk['message']['content'], 'model': model_to_use}
-                yield f"data: {json.dumps(content)}\n\n"
+        # The document and the search results identify the context, so a cached answer can be
+        # looked up as soon as the search is done. Retrieval has already started by then, since
+        # waiting for the lookup would add the search time to every cache miss.
+        cache_key = None
+        if cacheable:
+            search_links = None
+            if search_task is not None:
+                try:
+                    results = await asyncio.wait_for(asyncio.shield(search_task), max(web_deadline - loop.time(), 0))
+                    search_links = [result.get('link', '#') for result in results]
+                except Exception:
+                    # Reported with the web context below; without the results there is nothing to look up
+                    pass
+            if search_task is None or search_links is not None:
+                with stage_timer('answer_cache', timings):
+                    query_embedding = await loop.run_in_executor(self._retrieval_executor, embeddings.embed_query, query)
+                    fingerprint = context_fingerprint(document_id, search_links, deep_search)
+                    cache_key = (model_to_use, fingerprint, query, query_embedding)
+                    cached = self.answer_cache.get(*cache_key)
+                if cached is not None:
+                    if document_task is not None:
+                        # Only stops this request's wait; the indexing job itself carries on
+                        document_task.cancel()
+                    search_sources = self._search_sources(search_task.result()) if search_task else []
+                    header = self._context_header(model_to_use, compact, cached['context_sources'], document_id,
+                                                  search_sources, cached=True)
+                    if header is not None:
+                        yield header
+                    async for event in self._cached_answer_events(cached['answer'], model_to_use, compact,
+                                                                  include_timings, timings):
+                        yield event
+                    if session_id:
+                        self.conversations.append(session_id, query, cached['answer'])
+                    return
+        
+        branches = {}
+        if document_task is not None:
+            branches['file'] = document_task
+        if search_task is not None:
+            branches['web'] = asyncio.create_task(
+                self._web_context(query, search_task, deep_search, web_deadline, timings)
+            )
+        with stage_timer('context_fan_out', timings):
+            outcomes = dict(zip(branches, await asyncio.gather(*branches.values())))
+        
+        # Build context from file and/or web search
+        context_parts = [outcome['context'] for outcome in outcomes.values() if outcome['context']]
+        search_sources = self._search_sources(outcomes['web']['results']) if 'web' in outcomes else []
+        # Tells the client which of the requested sources the answer is based on
+        context_sources = {name: outcome['status'] for name, outcome in outcomes.items()}
+        if any(status not in ('included', 'empty') for status in context_sources.values()):
+            # Answers built on partial context aren't reused
+            cache_key = None
+        
+        # Build chat messages, trimming history and context to the model's prompt budget
+        chat_messages = await self._build_chat_messages(timings, model_to_use, query, CONTEXT_INSTRUCTIONS,
+                                                        context_parts, session)
+        
+        # Get response from Ollama
+        tokens = self._chat_tokens(model_to_use, chat_messages, timings)
+        
+        header = self._context_header(model_to_use, compact, context_sources, document_id, search_sources)
+        if header is not None:
+            yield header
+        
+        answer = []
+        async for event in self._admitted_content_events(model_to_use, tokens, answer, compact,
+                                                         {'model': model_to_use}, timings):
+            yield event
+        
+        # Only complete answers get here; a stream the client abandoned is closed at its last yield
+        if cache_key is not None and answer:
+            self.answer_cache.put(*cache_key, "".join(answer), context_sources)
+        
+        # A stream rejected by admission control produced no answer and isn't a turn
+        if session_id and answer:
+            self.conversations.append(session_id, query, "".join(answer))
+        
+        if include_timings:
+            if compact:
+                yield format_compact_event({'content': '', 'timings': timings.summary()})
+            else:
+                yield format_event({'content': '', 'model': model_to_use, 'timings': timings.summary()})
+    
+    
+    @staticmethod
+    async def _cached_answer_events(answer: str, model: str, compact: bool,
+                                    include_timings: bool, timings: RequestTimings) -> AsyncIterator[Union[str, bytes]]:
+        """Replay a cached answer after the first event, in the same format as a generated one, marked as cached"""
+        if compact:
+            yield format_compact_event({'content': answer})
+            if include_timings:
+                yield format_compact_event({'content': '', 'timings': timings.summary()})
+        else:
+            yield format_event({'content': answer, 'model': model, 'cached': True})
+            if include_timings:
+                yield format_event({'content': '', 'model': model, 'timings': timings.summary()})
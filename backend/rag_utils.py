@@ -1,21 +1,55 @@
+import hashlib
 import os
-import tempfile
+import threading
 import numpy as np
-import pytesseract
 
-from typing import List, Optional
+from cachetools import LRUCache
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.vectorstores import Chroma
-from langchain_community.vectorstores.utils import maximal_marginal_relevance
-from pdf2image import convert_from_path
-from sentence_transformers import CrossEncoder
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from config import settings
+from document_cache import DocumentCache
+from embedding_pool import EmbeddingPool
+from lazy_resource import LazyResource
+from lexical_index import BM25Index, LexicalIndexRegistry, reciprocal_rank_fusion
+from metrics import RequestTimings, stage_timer
+from ocr_utils import OCRPool
+from reranker import RerankingService
+from upload_utils import is_supported_file
+from vector_archive import VectorArchive
+from vector_store_registry import CollectionRegistry
 
-# Initialize embeddings
-model_name = "all-MiniLM-L6-v2"
-embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+def _load_embeddings():
+    # Imported here so that importing this module doesn't pull in torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL,
+                                 encode_kwargs={'batch_size': settings.EMBEDDING_ENCODE_BATCH_SIZE})
+
+
+def _load_reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(settings.RERANKING_MODEL)
+
+
+# Models are loaded on first use (or by the startup warm-up), not at import time
+embedding_model = LazyResource('embedding model', _load_embeddings)
+
+
+class LazyEmbeddings(Embeddings):
+    """Embeddings that load the HuggingFace model on first use"""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embedding_model.get().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embedding_model.get().embed_query(text)
+
+
+embeddings = LazyEmbeddings()
 
 # Initialize text splitter
 text_splitter = RecursiveCharacterTextSplitter(
@@ -26,170 +60,330 @@ text_splitter = RecursiveCharacterTextSplitter(
 
 class RAGManager:
     def __init__(self):
-        self.temp_dir = tempfile.mkdtemp()
-        self.vector_db = None
+        self.document_cache = DocumentCache()
         
-        # Initialize cross-encoder for reranking
-        self.reranker = CrossEncoder(settings.RERANKING_MODEL)
+        # Cross-encoder for reranking, loaded on first use and shared through a batching service
+        self.reranker_model = LazyResource('reranker', _load_reranker)
+        self.reranking_service = RerankingService(self.reranker_model)
         
         # Ensure ChromaDB persistence directory exists
         os.makedirs(settings.CHROMA_PERSIST_DIRECTORY, exist_ok=True)
         
-    def process_file(self, file_bytes: bytes, file_name: str) -> List[str]:
-        """Process a file and return a list of chunks"""
-        file_path = os.path.join(self.temp_dir, file_name)
+        # Scanned pages are OCR'd in parallel worker processes
+        self.ocr_pool = OCRPool()
+        
+        # Large batches of chunks can be embedded by a pool of worker processes
+        self.embedding_pool = EmbeddingPool() if settings.EMBEDDING_WORKERS > 0 else None
+        
+        # Cached documents can also be kept as compact quantized archives
+        self.vector_archive = None
+        if settings.DOCUMENT_CACHE_ENABLED and settings.EMBEDDING_STORAGE_DTYPE != 'float32':
+            self.vector_archive = VectorArchive()
+        
+        # Each document lives in its own collection; without the cache nothing else cleans them up
+        self.collections = CollectionRegistry(
+            embedding_function=embeddings,
+            delete_on_expiry=self._delete_when_idle
+        )
+        # Collections left over from before a restart go idle like any other
+        self.collections.track_stored(self.document_cache.keys())
+        
+        # BM25 indexes for keyword search, saved alongside cached documents
+        self.lexical_indexes = LexicalIndexRegistry(
+            directory=os.path.join(settings.CHROMA_PERSIST_DIRECTORY, 'bm25') if settings.DOCUMENT_CACHE_ENABLED else None
+        )
+        
+        # Embeddings of web page chunks, so pages that come up again aren't embedded again
+        self._web_embeddings = LRUCache(maxsize=settings.WEB_PAGE_CACHE_MAX_ENTRIES * settings.WEB_PAGE_MAX_CHUNKS)
+        self._web_embedding_lock = threading.Lock()
+        
+    def warm_up(self):
+        """Load the models that retrieval needs so the first RAG request doesn't pay for it"""
+        embedding_model.warm_up()
+        if settings.RERANKING_ENABLED:
+            self.reranker_model.warm_up()
+    
+    def close(self):
+        """Shut down the OCR and embedding worker processes and the reranking worker"""
+        self.ocr_pool.shutdown()
+        if self.embedding_pool is not None:
+            self.embedding_pool.shutdown()
+        self.reranking_service.close()
+    
+    def _delete_when_idle(self, doc_hash: str) -> bool:
+        """Whether an idle document's collection can be deleted from ChromaDB"""
+        # Archived documents are restored on their next use
+        if self.vector_archive is not None and self.vector_archive.has(doc_hash):
+            return True
+        return not settings.DOCUMENT_CACHE_ENABLED
+    
+    def process_file(self, file_path: str, file_name: str, content_hash: Optional[str] = None,
+                     on_progress: Optional[Callable[[int], None]] = None,
+                     timings: Optional[RequestTimings] = None) -> str:
+        """Process a file into its own vector store collection and return its document hash
+
+        Files that are already in the document cache skip parsing, OCR and embedding
+        and go straight to retrieval. Concurrent uploads of the same file are ingested once.
+        
+        Args:
+            file_path: Path of the file to ingest; the caller owns and removes it
+            file_name: Original name of the file, used for its type and as the chunk source
+            content_hash: SHA-256 of the file contents if already computed while saving it
+            on_progress: Called with the number of chunks indexed so far after each batch
+            timings: Collects the duration of each ingestion stage
+        """
+        if not is_supported_file(file_name):
+            raise ValueError(f"Unsupported file type: {file_name}")
+        
+        doc_hash = self.document_cache.compute_key(content_hash or self.document_cache.file_digest(file_path))
+        
+        with self.collections.lock(doc_hash):
+            if settings.DOCUMENT_CACHE_ENABLED:
+                entry = self.document_cache.get(doc_hash)
+                if entry and self._has_chunks(doc_hash, entry['chunk_ids']):
+                    print(f"Document cache hit for '{file_name}' ({doc_hash[:12]})")
+                    if on_progress:
+                        on_progress(len(entry['chunk_ids']))
+                    return doc_hash
+                if entry and self._restore_from_archive(doc_hash, timings):
+                    print(f"Document cache hit for '{file_name}' ({doc_hash[:12]}), restored from archive")
+                    if on_progress:
+                        on_progress(len(entry['chunk_ids']))
+                    return doc_hash
+                if entry:
+                    # The index is out of sync with ChromaDB, so ingest the file again
+                    self.document_cache.remove(doc_hash)
+            
+            chunk_ids = self._ingest(file_path, file_name, doc_hash, on_progress, timings)
         
-        # Save the file temporarily
-        with open(file_path, 'wb') as f:
-            f.write(file_bytes)
+        if settings.DOCUMENT_CACHE_ENABLED:
+            for evicted in self.document_cache.put(doc_hash, file_name, chunk_ids):
+                print(f"Evicting cached document '{evicted['file_name']}' from ChromaDB")
+                self.collections.drop(evicted['key'])
+                self.lexical_indexes.drop(evicted['key'])
+                if self.vector_archive is not None:
+                    self.vector_archive.drop(evicted['key'])
         
+        return doc_hash
+    
+    def _ingest(self, file_path: str, file_name: str, doc_hash: str,
+                on_progress: Optional[Callable[[int], None]] = None,
+                timings: Optional[RequestTimings] = None) -> List[str]:
+        """Chunk and embed a file into its collection in bounded batches and return the chunk ids"""
         # Process based on file type
         if file_name.lower().endswith('.pdf'):
-            chunks = self._process_pdf(file_path)
-        elif file_name.lower().endswith('.txt'):
-            chunks = self._process_txt(file_path)
+            chunk_type = 'pdf'
+            with stage_timer('parse', timings):
+                pages = self._process_pdf(file_path, timings)
+            chunks = (chunk for page_text in pages for chunk in text_splitter.split_text(page_text))
         else:
-            raise ValueError(f"Unsupported file type: {file_name}")
+            chunk_type = 'text'
+            chunks = self._iter_txt_chunks(file_path)
         
-        # Create vector store with metadata
-        docs = text_splitter.create_documents(chunks)
-        
-        # Add metadata to each document
-        for i, doc in enumerate(docs):
-            if not hasattr(doc, 'metadata') or not doc.metadata:
-                doc.metadata = {}
-            doc.metadata.update({
-                'source': file_name,
-                'chunk_id': str(i),
-                'chunk_type': 'text' if file_name.lower().endswith('.txt') else 'pdf'
-            })
-            
-        # Create or update ChromaDB vector store with persistence
-        self.vector_db = Chroma.from_documents(
-            documents=docs,
-            embedding=embeddings,
-            collection_name=settings.CHROMA_COLLECTION_NAME,
-            persist_directory=settings.CHROMA_PERSIST_DIRECTORY
-        )
+        vector_db = self.collections.get(doc_hash)
+        batches = self._batched(chunks, settings.EMBEDDING_BATCH_SIZE)
+        chunk_ids = []
+        lexical_index = BM25Index() if settings.HYBRID_SEARCH_ENABLED else None
+        if self.vector_archive is not None:
+            self.vector_archive.start(doc_hash)
         
-        # Persist to disk
-        self.vector_db.persist()
+        while True:
+            with stage_timer('chunking', timings):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            
+            # Content-derived ids make re-ingesting the same file an upsert instead of a duplicate
+            batch_ids = [f"{doc_hash}-{len(chunk_ids) + i}" for i in range(len(batch))]
+            metadatas = [
+                {
+                    'source': file_name,
+                    'doc_hash': doc_hash,
+                    'chunk_id': str(len(chunk_ids) + i),
+                    'chunk_type': chunk_type
+                }
+                for i in range(len(batch))
+            ]
+            with stage_timer('embedding', timings):
+                batch_embeddings = self._embed_documents(batch)
+            with stage_timer('chroma_write', timings):
+                vector_db._collection.upsert(ids=batch_ids, embeddings=batch_embeddings,
+                                             documents=batch, metadatas=metadatas)
+            if self.vector_archive is not None:
+                with stage_timer('archive_write', timings):
+                    self.vector_archive.write_batch(doc_hash, len(chunk_ids), batch_ids, batch,
+                                                    metadatas, batch_embeddings)
+            if lexical_index is not None:
+                with stage_timer('lexical_index', timings):
+                    lexical_index.add(batch_ids, batch)
+            chunk_ids.extend(batch_ids)
+            if on_progress:
+                on_progress(len(chunk_ids))
         
-        return chunks
+        if lexical_index is not None:
+            self.lexical_indexes.put(doc_hash, lexical_index)
+        if self.vector_archive is not None:
+            self.vector_archive.finish(doc_hash)
+        return chunk_ids
+    
+    def _embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of chunks, spreading large batches over the embedding pool if there is one"""
+        if self.embedding_pool is not None and len(texts) >= settings.EMBEDDING_PROCESS_MIN_BATCH:
+            return self.embedding_pool.embed(texts)
+        return embeddings.embed_documents(texts)
     
-    def _process_pdf(self, file_path: str) -> List[str]:
-        """Process a PDF file and return extracted text"""
+    def _restore_from_archive(self, doc_hash: str, timings: Optional[RequestTimings] = None) -> bool:
+        """Rebuild a document's collection from its archive; the caller holds the document's lock"""
+        if self.vector_archive is None or not self.vector_archive.has(doc_hash):
+            return False
+        print(f"Restoring document {doc_hash[:12]} from the vector archive")
+        with stage_timer('archive_restore', timings):
+            vector_db = self.collections.get(doc_hash)
+            for ids, texts, metadatas, vectors in self.vector_archive.read_batches(doc_hash):
+                vector_db._collection.upsert(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+        return True
+    
+    def _open_for_retrieval(self, doc_hash: str, timings: Optional[RequestTimings] = None) -> Optional[Chroma]:
+        """Get a document's collection, restoring it from the archive if it was deleted while idle"""
+        vector_db = self._stored_collection(doc_hash)
+        if vector_db is not None:
+            return vector_db
+        with self.collections.lock(doc_hash):
+            # Another request may have restored it while this one waited for the lock
+            vector_db = self._stored_collection(doc_hash)
+            if vector_db is None and self._restore_from_archive(doc_hash, timings):
+                vector_db = self.collections.get(doc_hash)
+            return vector_db
+    
+    def _stored_collection(self, doc_hash: str) -> Optional[Chroma]:
+        """Get a document's collection if it exists and holds its chunks"""
+        if not self.collections.exists(doc_hash):
+            return None
+        vector_db = self.collections.get(doc_hash)
+        return vector_db if vector_db._collection.count() > 0 else None
+    
+    @staticmethod
+    def _batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def _has_chunks(self, doc_hash: str, chunk_ids: List[str]) -> bool:
+        """Check that all chunks of a cached document are still stored in ChromaDB"""
+        if not chunk_ids:
+            return True
+        if not self.collections.exists(doc_hash):
+            return False
+        return self.collections.get(doc_hash)._collection.count() == len(chunk_ids)
+    
+    def _process_pdf(self, file_path: str, timings: Optional[RequestTimings] = None) -> List[str]:
+        """Process a PDF file and return extracted text, using OCR only for pages without a text layer"""
         try:
             # First try using PyPDFLoader
             loader = PyPDFLoader(file_path)
             documents = loader.load()
             text_content = [doc.page_content for doc in documents]
-            
-            # If the extracted text is too small, try OCR
-            if sum(len(text) for text in text_content) < 100:
-                return self._ocr_pdf(file_path)
-                
-            return text_content
         except Exception as e:
             print(f"Error processing PDF with PyPDFLoader: {e}")
             # Fallback to OCR
-            return self._ocr_pdf(file_path)
+            with stage_timer('ocr', timings):
+                return self._ocr_pdf(file_path)
+        
+        # Pages with (almost) no extractable text are most likely scans
+        scanned_pages = [i for i, text in enumerate(text_content)
+                         if len(text.strip()) < settings.OCR_MIN_PAGE_CHARS]
+        if scanned_pages:
+            print(f"Running OCR on {len(scanned_pages)} of {len(text_content)} pages...")
+            with stage_timer('ocr', timings):
+                ocr_text = self._ocr_pdf(file_path, scanned_pages)
+            for page, text in zip(scanned_pages, ocr_text):
+                text_content[page] = text
+        
+        return text_content
     
-    def _ocr_pdf(self, file_path: str) -> List[str]:
-        """Process a PDF file using OCR"""
+    def _ocr_pdf(self, file_path: str, pages: Optional[List[int]] = None) -> List[str]:
+        """Process the given pages of a PDF file (all pages by default) using OCR"""
         try:
-            images = convert_from_path(file_path)
-            text_content = []
-            
-            for i, image in enumerate(images):
-                text = pytesseract.image_to_string(image)
-                text_content.append(text)
-                
-            return text_content
+            return self.ocr_pool.ocr(file_path, pages)
         except Exception as e:
             print(f"Error performing OCR on PDF: {e}")
             return ["Error extracting text from PDF."]
     
-    def _process_txt(self, file_path: str) -> List[str]:
-        """Process a text file and return extracted text"""
+    def _iter_txt_chunks(self, file_path: str) -> Iterator[str]:
+        """Split a text file into chunks while reading it in blocks
+
+        Every chunk respects the chunk size and all of the text is covered, but chunk
+        boundaries near the block edges can differ from splitting the whole file at once,
+        because the splitter only sees one block and the carried-over tail at a time.
+        """
+        block_size = settings.RAG_CHUNK_SIZE * 100
+        carry = ""
         try:
-            loader = TextLoader(file_path)
-            documents = loader.load()
-            return [doc.page_content for doc in documents]
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                while block := f.read(block_size):
+                    text = carry + block
+                    chunks = text_splitter.split_text(text)
+                    if not chunks:
+                        carry = text
+                        continue
+                    # The last chunk may continue in the next block, so split it again with that block.
+                    # Carry the raw text rather than the chunk, which has its trailing whitespace stripped.
+                    yield from chunks[:-1]
+                    start = text.rfind(chunks[-1])
+                    carry = text[start:] if start >= 0 else chunks[-1]
         except Exception as e:
-            print(f"Error processing text file: {e}")
-            
-            # Fallback: read file directly
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                return [content]
-            except Exception as e2:
-                print(f"Error reading text file directly: {e2}")
-                return ["Error extracting text from file."]
-    
-    def get_relevant_context(self, query: str, top_k: int = 5, use_mmr: bool = True, use_reranking: bool = True, 
-                         fetch_k: int = 30, lambda_mult: float = 0.7) -> Optional[str]:
+            print(f"Error reading text file: {e}")
+            if not carry:
+                carry = "Error extracting text from file."
+        if carry.strip():
+            yield from text_splitter.split_text(carry)
+    
+    def get_relevant_context(self, query: str, document_id: str, top_k: int = 5, use_mmr: bool = True, use_reranking: bool = True, 
+                         fetch_k: int = 20, lambda_mult: float = 0.7, use_hybrid: bool = True,
+                         timings: Optional[RequestTimings] = None) -> Optional[str]:
         """Get relevant context from the vector store based on query with optional reranking and MMR
         
         Args:
             query: The query to search for
+            document_id: Hash of the processed document whose collection is searched
             top_k: Number of documents to return in the final result
             use_mmr: Whether to use Maximum Marginal Relevance to ensure diversity
             use_reranking: Whether to use the cross-encoder for reranking
             fetch_k: Number of documents to initially retrieve (should be larger than top_k)
             lambda_mult: Diversity-relevance tradeoff for MMR (0-1). Higher values prioritize relevance.
+            use_hybrid: Whether to fuse BM25 keyword matches with the vector search candidates
+            timings: Collects the duration of each retrieval stage
         """
-        if not self.vector_db:
+        vector_db = self._open_for_retrieval(document_id, timings)
+        if vector_db is None:
             return None
         
-        # Fetch initial candidates (larger set for reranking)
-        initial_docs = self.vector_db.similarity_search(
-            query, 
-            k=fetch_k,
-            search_type=settings.CHROMA_DISTANCE_FUNCTION
-        )
+        # Embed the query once; candidate embeddings come back from ChromaDB with the search
+        with stage_timer('query_embedding', timings):
+            query_embedding = embeddings.embed_query(query)
+        with stage_timer('similarity_search', timings):
+            initial_docs, candidate_embeddings = self._search_with_embeddings(vector_db, query_embedding, fetch_k)
         
-        # Apply reranking if enabled
-        if use_reranking:
-            print(f"Reranking {len(initial_docs)} documents...")
-            # Prepare query-document pairs for reranking
-            rerank_pairs = [[query, doc.page_content] for doc in initial_docs]
-            
-            # Get relevance scores
-            rerank_scores = self.reranker.predict(rerank_pairs)
-            
-            # Sort documents by score
-            scored_docs = list(zip(initial_docs, rerank_scores))
-            scored_docs.sort(key=lambda x: x[1], reverse=True)
-            
-            # Get top documents after reranking (still more than final top_k for MMR)
-            reranked_docs = [doc for doc, score in scored_docs[:min(15, len(scored_docs))]]  # Take top 15 for MMR
-        else:
-            reranked_docs = initial_docs[:min(15, len(initial_docs))]  # Use top initial docs without reranking
+        # Keyword matches catch exact identifiers that embeddings tend to miss
+        lexical_ids = []
+        if use_hybrid:
+            with stage_timer('lexical_search', timings):
+                lexical_index = self._get_lexical_index(document_id, vector_db)
+                lexical_ids = [chunk_id for chunk_id, _ in lexical_index.search(query, settings.BM25_FETCH_K)]
+            if lexical_ids:
+                initial_docs, candidate_embeddings = self._fuse_candidates(
+                    vector_db, initial_docs, candidate_embeddings, lexical_ids, fetch_k
+                )
         
-        # Apply MMR if enabled
-        if use_mmr:
-            # Get embeddings for the query
-            query_embedding = np.array(embeddings.embed_query(query))
-            
-            # Process documents for MMR
-            doc_texts = [doc.page_content for doc in reranked_docs]
-            doc_embeddings = [np.array(embeddings.embed_query(text)) for text in doc_texts]
-            
-            # Apply MMR
-            mmr_indices = maximal_marginal_relevance(
-                query_embedding, 
-                doc_embeddings, 
-                k=min(top_k, len(doc_embeddings)), 
-                lambda_mult=lambda_mult
-            )
-            
-            # Get the filtered documents
-            final_docs = [reranked_docs[i] for i in mmr_indices]
-        else:
-            # Use top reranked docs without diversity filtering
-            final_docs = reranked_docs[:min(top_k, len(reranked_docs))]
+        lexical_matches = set(lexical_ids)
+        pinned = {i for i, doc in enumerate(initial_docs) if doc.id in lexical_matches}
+        final_docs = self._select_candidates(query, query_embedding, initial_docs, candidate_embeddings,
+                                             top_k, use_mmr, use_reranking, lambda_mult, pinned, timings=timings)
         
         # Combine the relevant content
         if final_docs:
@@ -197,3 +391,161 @@ class RAGManager:
             return context
         
         return None
+    
+    def select_web_context(self, query: str, pages: List[Dict], top_k: int = 5, use_mmr: bool = True,
+                           use_reranking: bool = True, lambda_mult: float = 0.7,
+                           timings: Optional[RequestTimings] = None) -> List[Document]:
+        """Select the chunks of fetched web pages that are most relevant to a query
+        
+        Pages are chunked and embedded in memory and go through the same reranking
+        and MMR selection as document context.
+        
+        Args:
+            query: The query to select chunks for
+            pages: Fetched pages with url, title and text
+            top_k: Number of chunks to return
+            use_mmr: Whether to use Maximum Marginal Relevance to ensure diversity
+            use_reranking: Whether to use the cross-encoder for reranking
+            lambda_mult: Diversity-relevance tradeoff for MMR (0-1). Higher values prioritize relevance.
+            timings: Collects the duration of each selection stage
+            
+        Returns:
+            The selected chunks, with the url and title of their page in the metadata
+        """
+        docs = []
+        with stage_timer('web_chunking', timings):
+            for page in pages:
+                for text in text_splitter.split_text(page['text'])[:settings.WEB_PAGE_MAX_CHUNKS]:
+                    # Content-derived ids keep cached rerank scores valid when a page changes
+                    docs.append(Document(id=hashlib.sha1(text.encode()).hexdigest(), page_content=text,
+                                         metadata={'source': page['url'], 'title': page['title']}))
+        if not docs:
+            return []
+        
+        with stage_timer('web_embedding', timings):
+            query_embedding = embeddings.embed_query(query)
+            doc_embeddings = self._embed_web_chunks(docs)
+        return self._select_candidates(query, query_embedding, docs, doc_embeddings, top_k, use_mmr,
+                                       use_reranking, lambda_mult, stage_prefix='web_', timings=timings)
+    
+    def _embed_web_chunks(self, docs: List[Document]) -> np.ndarray:
+        """Embed web page chunks, reusing the embeddings of chunks seen in earlier requests"""
+        with self._web_embedding_lock:
+            vectors = [self._web_embeddings.get(doc.id) for doc in docs]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self._embed_documents([docs[i].page_content for i in missing])
+            with self._web_embedding_lock:
+                for i, vector in zip(missing, new_vectors):
+                    vectors[i] = self._web_embeddings[docs[i].id] = np.asarray(vector, dtype=np.float32)
+        return np.vstack(vectors)
+    
+    def _select_candidates(self, query: str, query_embedding: List[float], docs: List[Document],
+                           doc_embeddings: np.ndarray, top_k: int, use_mmr: bool, use_reranking: bool,
+                           lambda_mult: float, pinned: Collection[int] = (), stage_prefix: str = '',
+                           timings: Optional[RequestTimings] = None) -> List[Document]:
+        """Rerank candidates and pick a diverse top_k of them with MMR"""
+        # Apply reranking if enabled
+        if use_reranking and docs:
+            similarities = self._cosine_similarities(query_embedding, doc_embeddings)
+            with stage_timer(f'{stage_prefix}rerank', timings):
+                ranked_indices = self.reranking_service.rerank(query, docs, similarities, top_k, pinned)
+        else:
+            ranked_indices = list(range(len(docs)))
+        
+        # Keep the top candidates (still more than final top_k for MMR)
+        ranked_indices = ranked_indices[:15]
+        
+        # Apply MMR if enabled
+        if use_mmr and ranked_indices:
+            # Apply MMR directly on the stored embeddings of the candidates
+            with stage_timer(f'{stage_prefix}mmr', timings):
+                mmr_indices = self._ranked_mmr(doc_embeddings[ranked_indices],
+                                               k=min(top_k, len(ranked_indices)),
+                                               lambda_mult=lambda_mult)
+            
+            # Get the filtered documents
+            return [docs[ranked_indices[i]] for i in mmr_indices]
+        
+        # Use top reranked docs without diversity filtering
+        return [docs[i] for i in ranked_indices[:top_k]]
+    
+    @staticmethod
+    def _search_with_embeddings(vector_db: Chroma, query_embedding: List[float],
+                                k: int) -> Tuple[List[Document], np.ndarray]:
+        """Run a similarity search and return the matched documents with their stored embeddings"""
+        results = vector_db._collection.query(
+            query_embeddings=[query_embedding],
+            n_results=k,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        
+        docs = [
+            Document(id=chunk_id, page_content=text, metadata=metadata or {})
+            for chunk_id, text, metadata in zip(results["ids"][0], results["documents"][0], results["metadatas"][0])
+        ]
+        doc_embeddings = np.asarray(results["embeddings"][0], dtype=np.float32).reshape(len(docs), -1)
+        return docs, doc_embeddings
+    
+    def _get_lexical_index(self, doc_hash: str, vector_db: Chroma) -> BM25Index:
+        """Get a document's BM25 index, building it from ChromaDB if the document predates it"""
+        index = self.lexical_indexes.get(doc_hash)
+        if index is None:
+            print(f"Building BM25 index for document {doc_hash[:12]}...")
+            stored = vector_db._collection.get(include=["documents"])
+            # Chunk ids end in the chunk's position in the document
+            chunks = sorted(zip(stored["ids"], stored["documents"]), key=lambda chunk: int(chunk[0].rsplit('-', 1)[1]))
+            index = self.lexical_indexes.build(doc_hash, chunks)
+        return index
+    
+    @staticmethod
+    def _fuse_candidates(vector_db: Chroma, docs: List[Document], doc_embeddings: np.ndarray,
+                         lexical_ids: List[str], k: int) -> Tuple[List[Document], np.ndarray]:
+        """Merge vector and keyword candidates with reciprocal rank fusion and keep the best k"""
+        dense_ids = [doc.id for doc in docs]
+        known = set(dense_ids)
+        missing = [chunk_id for chunk_id in lexical_ids if chunk_id not in known]
+        if missing:
+            # Keyword-only matches still need their text and embeddings for reranking and MMR
+            results = vector_db._collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            fetched = [
+                Document(id=chunk_id, page_content=text, metadata=metadata or {})
+                for chunk_id, text, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+            ]
+            fetched_embeddings = np.asarray(results["embeddings"], dtype=np.float32).reshape(len(fetched), -1)
+            docs = docs + fetched
+            doc_embeddings = np.vstack([doc_embeddings, fetched_embeddings]) if len(doc_embeddings) else fetched_embeddings
+        
+        positions = {doc.id: i for i, doc in enumerate(docs)}
+        order = [positions[chunk_id] for chunk_id in reciprocal_rank_fusion([dense_ids, lexical_ids])
+                 if chunk_id in positions][:k]
+        return [docs[i] for i in order], doc_embeddings[order]
+    
+    @staticmethod
+    def _ranked_mmr(ranked_embeddings: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+        """Maximal marginal relevance over candidates that are already ordered by relevance
+
+        Relevance falls linearly with rank, so the fused and reranked order decides
+        what is relevant and the embeddings only decide what is redundant. Scoring
+        relevance by query similarity instead would undo reranking and drop keyword
+        matches whose embeddings happen to be far from the query.
+        """
+        count = len(ranked_embeddings)
+        relevance = 1 - np.arange(count) / count
+        norms = np.linalg.norm(ranked_embeddings, axis=1, keepdims=True)
+        normalized = ranked_embeddings / np.where(norms == 0, 1, norms)
+        similarity = normalized @ normalized.T
+        
+        selected = [0]
+        while len(selected) < min(k, count):
+            redundancy = similarity[:, selected].max(axis=1)
+            scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+            scores[selected] = -np.inf
+            selected.append(int(np.argmax(scores)))
+        return selected
+    
+    @staticmethod
+    def _cosine_similarities(query_embedding: List[float], doc_embeddings: np.ndarray) -> np.ndarray:
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.linalg.norm(doc_embeddings, axis=1) * np.linalg.norm(query_vector)
+        return doc_embeddings @ query_vector / np.where(norms == 0, 1, norms)
@@ -0,0 +1,192 @@
+import hashlib
+import queue
+import threading
+import time
+
+import numpy as np
+
+from cachetools import LRUCache
+from concurrent.futures import Future
+from typing import Collection, Dict, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from config import settings
+from lazy_resource import LazyResource
+
+
+class RerankingService:
+    """Cross-encoder reranker shared by all requests.
+
+    Requests put their query/chunk pairs on a bounded queue and a worker thread
+    scores everything that arrives within `max_wait_ms` with a single `predict`
+    call, so concurrent requests share batches instead of each running its own.
+    Scores are cached per (query hash, chunk id), and reranking is skipped or
+    narrowed when the vector similarities already make the ranking clear.
+    """
+
+    def __init__(self,
+                 model: LazyResource,
+                 max_batch_size: int = settings.RERANK_BATCH_SIZE,
+                 max_wait_ms: int = settings.RERANK_MAX_WAIT_MS,
+                 queue_size: int = settings.RERANK_QUEUE_SIZE,
+                 cache_size: int = settings.RERANK_CACHE_SIZE,
+                 skip_margin: float = settings.RERANK_SKIP_MARGIN,
+                 shrink_margin: float = settings.RERANK_SHRINK_MARGIN):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.skip_margin = skip_margin
+        self.shrink_margin = shrink_margin
+        self._queue: "queue.Queue[Optional[Tuple[List[List[str]], Future]]]" = queue.Queue(maxsize=queue_size)
+        self._cache = LRUCache(maxsize=cache_size)
+        self._cache_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._worker_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'skipped': 0,
+            'shrunk': 0,
+            'pairs_scored': 0,
+            'batches': 0,
+            'cache_hits': 0,
+        }
+
+    def rerank(self, query: str, docs: List[Document], similarities: np.ndarray, top_k: int,
+               pinned: Collection[int] = ()) -> List[int]:
+        """Return candidate indices ordered by relevance
+
+        Args:
+            query: The query the candidates were retrieved for
+            docs: Candidates in retrieval order
+            similarities: Cosine similarity of each candidate to the query
+            top_k: Number of documents the caller will finally keep
+            pinned: Candidates that are always reranked whatever their similarity, e.g. keyword matches
+        """
+        self._record('requests')
+        top_k = max(top_k, 1)
+        vector_order = [int(i) for i in np.argsort(-similarities, kind='stable')]
+
+        # Nothing to choose between, or the top_k set is already clearly separated from the rest
+        if len(docs) <= top_k or (
+                similarities[vector_order[top_k - 1]] - similarities[vector_order[top_k]] >= self.skip_margin
+                and set(pinned) <= set(vector_order[:top_k])):
+            self._record('skipped')
+            return vector_order
+
+        # Candidates far below the top_k-th similarity are left in vector order after the reranked ones
+        cutoff = similarities[vector_order[top_k - 1]] - self.shrink_margin
+        to_rerank = [i for i in vector_order if similarities[i] >= cutoff or i in pinned]
+        rest = [i for i in vector_order if similarities[i] < cutoff and i not in pinned]
+        if rest:
+            self._record('shrunk')
+
+        print(f"Reranking {len(to_rerank)} of {len(docs)} documents...")
+        scores = self.score(query, [(docs[i].id, docs[i].page_content) for i in to_rerank])
+        reranked = [i for _, i in sorted(zip(scores, to_rerank), key=lambda x: x[0], reverse=True)]
+        return reranked + rest
+
+    def score(self, query: str, chunks: Sequence[Tuple[Optional[str], str]]) -> List[float]:
+        """Score (chunk id, text) pairs against a query, using cached scores where possible"""
+        query_hash = hashlib.sha1(query.encode()).hexdigest()
+        scores: List[Optional[float]] = [None] * len(chunks)
+        with self._cache_lock:
+            for i, (chunk_id, _) in enumerate(chunks):
+                if chunk_id is not None and (query_hash, chunk_id) in self._cache:
+                    scores[i] = self._cache[(query_hash, chunk_id)]
+                    self._stats['cache_hits'] += 1
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            future: Future = Future()
+            self._ensure_worker()
+            # Blocks when the queue is full, which pushes back on callers instead of growing memory
+            self._queue.put(([[query, chunks[i][1]] for i in missing], future))
+            new_scores = future.result()
+            with self._cache_lock:
+                for i, score in zip(missing, new_scores):
+                    scores[i] = score
+                    chunk_id = chunks[i][0]
+                    if chunk_id is not None:
+                        self._cache[(query_hash, chunk_id)] = score
+        return scores
+
+    def stats(self) -> Dict:
+        with self._cache_lock:
+            return dict(self._stats, cache_entries=len(self._cache), queued=self._queue.qsize())
+
+    def close(self):
+        """Stop the worker thread without blocking, even if the queue is full"""
+        with self._worker_lock:
+            self._closed.set()
+            if self._worker is not None:
+                try:
+                    # Wakes the worker if it is waiting for work; if the queue is full it isn't,
+                    # and it sees the event after its current batch
+                    self._queue.put_nowait(None)
+                except queue.Full:
+                    pass
+                self._worker = None
+
+    def _record(self, stat: str, count: int = 1):
+        # Counters are updated from every retrieval thread and the worker
+        with self._cache_lock:
+            self._stats[stat] += count
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._closed.is_set():
+                raise RuntimeError('Reranking service is closed')
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='reranker', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            item = self._queue.get()
+            if item is None:
+                continue
+            batch = [item]
+            pair_count = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+
+            # Collect whatever else arrives within the wait window
+            while pair_count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    break
+                batch.append(item)
+                pair_count += len(item[0])
+
+            self._score_batch(batch)
+
+        # Fail the requests still waiting, including callers that were blocked on the full
+        # queue, so they don't block forever
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                return
+            if item is not None:
+                item[1].set_exception(RuntimeError('Reranking service is closed'))
+
+    def _score_batch(self, batch: List[Tuple[List[List[str]], Future]]):
+        pairs = [pair for request_pairs, _ in batch for pair in request_pairs]
+        try:
+            scores = self.model.get().predict(pairs, batch_size=self.max_batch_size)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self._record('batches')
+        self._record('pairs_scored', len(pairs))
+        offset = 0
+        for request_pairs, future in batch:
+            future.set_result([float(score) for score in scores[offset:offset + len(request_pairs)]])
+            offset += len(request_pairs)
@@ -0,0 +1,53 @@
+import threading
+
+from cachetools import TTLCache
+from typing import Dict, List, Optional
+from config import settings
+
+
+class SearchResultCache:
+    """Thread-safe TTL/LRU cache of search results keyed by provider and normalized query"""
+
+    def __init__(self,
+                 max_entries: int = settings.SEARCH_CACHE_MAX_ENTRIES,
+                 ttl: int = settings.SEARCH_CACHE_TTL):
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Collapse case and whitespace so trivially different queries share an entry"""
+        return " ".join(query.lower().split())
+
+    def get(self, provider: str, query: str, max_results: int) -> Optional[List[Dict]]:
+        key = (provider, self.normalize(query), max_results)
+        with self._lock:
+            results = self._cache.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(results)
+
+    def put(self, provider: str, query: str, max_results: int, results: List[Dict]):
+        key = (provider, self.normalize(query), max_results)
+        with self._lock:
+            self._cache[key] = list(results)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._cache),
+                'max_entries': self._cache.maxsize,
+                'ttl': self._cache.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared by every search provider
+search_cache = SearchResultCache()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import time
+
+import orjson
+
+from typing import AsyncIterator, Dict, Optional
+from config import settings
+
+
+def format_event(payload: Dict) -> str:
+    """Frame a payload as an SSE data event, the way existing clients expect"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def format_compact_event(payload: Dict) -> bytes:
+    """Frame a payload as an SSE data event with orjson"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+async def coalesce_tokens(tokens: AsyncIterator[str],
+                          window_ms: int = settings.STREAM_COALESCE_WINDOW_MS,
+                          max_bytes: int = settings.STREAM_COALESCE_MAX_BYTES) -> AsyncIterator[str]:
+    """Group streamed tokens into larger pieces
+
+    The first token is passed through right away so time to first token is
+    unaffected. After that, tokens are buffered until `window_ms` has passed since
+    the first buffered token or the buffer reaches `max_bytes`, whichever comes first.
+    A buffer is also flushed when the window runs out while waiting for the model.
+    """
+    iterator = tokens.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    buffer_started: Optional[float] = None
+    first = True
+    pending = None
+    window = window_ms / 1000
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None
+            if buffer_started is not None:
+                timeout = max(buffer_started + window - time.monotonic(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                # The window ran out while the model was still working on the next token
+                yield "".join(buffer)
+                buffer, buffered_bytes, buffer_started = [], 0, None
+                continue
+
+            finished, pending = pending, None
+            try:
+                token = finished.result()
+            except StopAsyncIteration:
+                break
+
+            if first:
+                first = False
+                yield token
+                continue
+
+            buffer.append(token)
+            buffered_bytes += len(token.encode())
+            if buffer_started is None:
+                buffer_started = time.monotonic()
+            if buffered_bytes >= max_bytes or time.monotonic() - buffer_started >= window:
+                yield "".join(buffer)
+                buffer, buffered_bytes, buffer_started = [], 0, None
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+    if buffer:
+        yield "".join(buffer)
@@ -0,0 +1,100 @@
+import math
+import threading
+
+from typing import Dict, Optional
+from config import settings
+from lazy_resource import LazyResource
+
+
+def _load_tokenizer(name: str):
+    # Imported lazily; transformers comes with sentence-transformers but is slow to import
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(name)
+
+
+class TokenCounter:
+    """Counts prompt tokens for a model.
+
+    Uses the model's HuggingFace tokenizer when one is configured in MODEL_TOKENIZERS,
+    and otherwise a character-based estimate that errs on the high side. A tokenizer
+    that fails to load is not retried, so counting never blocks on the network twice.
+    """
+
+    # Rough characters per token for English text with the common BPE vocabularies
+    CHARS_PER_TOKEN = 3.5
+    # Chat templates add role markers and separators around every message
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = LazyResource(f'tokenizer {tokenizer_name}',
+                                       lambda: _load_tokenizer(tokenizer_name)) if tokenizer_name else None
+
+    def _get_tokenizer(self):
+        if self._tokenizer is None:
+            return None
+        if self._tokenizer.error is not None:
+            return None
+        try:
+            return self._tokenizer.get()
+        except Exception as e:
+            print(f"Falling back to estimated token counts: {e}")
+            return None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = self._get_tokenizer()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        return self.count(message['content']) + self.MESSAGE_OVERHEAD
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens, preferring to break between paragraphs or lines"""
+        if max_tokens <= 0:
+            return ""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+
+        end = int(len(text) * max_tokens / tokens)
+        while end > 0:
+            cut = text[:end]
+            for separator in ("\n\n", "\n", " "):
+                boundary = cut.rfind(separator)
+                # Only back off to a boundary if it doesn't throw away most of the text
+                if boundary > end // 2:
+                    cut = cut[:boundary]
+                    break
+            if self.count(cut) <= max_tokens:
+                return cut.rstrip()
+            end = int(end * 0.9)
+        return ""
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model: str) -> TokenCounter:
+    """Get the shared token counter for a model"""
+    with _counters_lock:
+        counter = _counters.get(model)
+        if counter is None:
+            counter = TokenCounter(settings.MODEL_TOKENIZERS.get(model))
+            _counters[model] = counter
+        return counter
+
+
+def warm_up_tokenizers():
+    """Load the configured tokenizers so the first prompts don't wait for them"""
+    for model in settings.MODEL_TOKENIZERS:
+        get_token_counter(model)._get_tokenizer()
+
+
+def get_prompt_budget(model: str) -> int:
+    """Maximum number of prompt tokens to send to a model"""
+    return settings.MODEL_PROMPT_TOKEN_BUDGETS.get(model, settings.PROMPT_TOKEN_BUDGET)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import tempfile
+
+from dataclasses import dataclass
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+from config import settings
+
+# Extensions of the files that can be indexed
+SUPPORTED_FILE_TYPES = ('.pdf', '.txt')
+
+
+def is_supported_file(file_name: Optional[str]) -> bool:
+    """Whether a file can be indexed, judging by its name"""
+    return bool(file_name) and file_name.lower().endswith(SUPPORTED_FILE_TYPES)
+
+
+@dataclass
+class SavedUpload:
+    """An uploaded file streamed to a temporary path"""
+    path: str
+    file_name: str
+    size: int
+    sha256: str
+
+
+async def save_upload(file: UploadFile,
+                      max_bytes: int = settings.UPLOAD_MAX_BYTES,
+                      chunk_size: int = settings.UPLOAD_CHUNK_SIZE) -> SavedUpload:
+    """Stream an upload to a temporary file in chunks, hashing it on the way
+
+    Raises:
+        HTTPException: 415 if the file type can't be indexed, 413 if the upload is larger than max_bytes
+    """
+    if not is_supported_file(file.filename):
+        raise HTTPException(status_code=415,
+                            detail=f"Unsupported file type: {file.filename}; supported types are "
+                                   f"{', '.join(SUPPORTED_FILE_TYPES)}")
+    if settings.UPLOAD_TEMP_DIR:
+        os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    suffix = os.path.splitext(file.filename or '')[1]
+    fd, path = tempfile.mkstemp(prefix='upload-', suffix=suffix, dir=settings.UPLOAD_TEMP_DIR)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := await file.read(chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413,
+                                        detail=f"File is larger than the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        remove_upload(path)
+        raise
+
+    return SavedUpload(path=path, file_name=file.filename, size=size, sha256=digest.hexdigest())
+
+
+def remove_upload(path: Optional[str]):
+    """Delete a temporary upload, ignoring files that are already gone"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error removing temporary upload {path}: {e}")
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from config import settings
+
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+
+
+def quantize(embeddings: Sequence[Sequence[float]], dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Convert embeddings to a compact dtype, returning the vectors and, for int8, their scales
+
+    int8 uses symmetric per-vector scaling, which changes cosine similarities
+    between sentence embeddings by less than 0.01.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if dtype == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def dequantize(vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    vectors = vectors.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+
+class VectorArchive:
+    """Compact on-disk copy of each document's chunks and quantized embeddings.
+
+    ChromaDB only stores float32 vectors, so documents that are not in use are
+    kept here instead: their collections are deleted when they go idle and
+    restored from the archive, without re-embedding, the next time they are needed.
+    Each ingestion batch is written as its own file, so archiving a large document
+    never holds all of its vectors in memory.
+    """
+
+    def __init__(self,
+                 directory: str = os.path.join(settings.CHROMA_PERSIST_DIRECTORY, 'archive'),
+                 dtype: str = settings.EMBEDDING_STORAGE_DTYPE):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+        self.directory = directory
+        self.dtype = dtype
+
+    def _document_dir(self, doc_hash: str) -> str:
+        return os.path.join(self.directory, doc_hash)
+
+    def has(self, doc_hash: str) -> bool:
+        return os.path.exists(os.path.join(self._document_dir(doc_hash), 'complete'))
+
+    def start(self, doc_hash: str):
+        """Clear any partial archive of a document before writing its batches"""
+        shutil.rmtree(self._document_dir(doc_hash), ignore_errors=True)
+        os.makedirs(self._document_dir(doc_hash))
+
+    def write_batch(self, doc_hash: str, offset: int, ids: List[str], texts: List[str],
+                    metadatas: List[Dict], embeddings: Sequence[Sequence[float]]):
+        vectors, scales = quantize(embeddings, self.dtype)
+        records = json.dumps({'ids': ids, 'texts': texts, 'metadatas': metadatas}).encode()
+        arrays = {'vectors': vectors, 'records': np.frombuffer(records, dtype=np.uint8)}
+        if scales is not None:
+            arrays['scales'] = scales
+        np.savez_compressed(os.path.join(self._document_dir(doc_hash), f"{offset:09d}.npz"), **arrays)
+
+    def finish(self, doc_hash: str):
+        """Mark a document's archive as complete so it can be restored from"""
+        open(os.path.join(self._document_dir(doc_hash), 'complete'), 'w').close()
+
+    def read_batches(self, doc_hash: str) -> Iterator[Tuple[List[str], List[str], List[Dict], np.ndarray]]:
+        """Yield (ids, texts, metadatas, float32 embeddings) for each archived batch in order"""
+        document_dir = self._document_dir(doc_hash)
+        for name in sorted(os.listdir(document_dir)):
+            if not name.endswith('.npz'):
+                continue
+            with np.load(os.path.join(document_dir, name)) as data:
+                records = json.loads(data['records'].tobytes())
+                scales = data['scales'] if 'scales' in data.files else None
+                yield records['ids'], records['texts'], records['metadatas'], dequantize(data['vectors'], scales)
+
+    def drop(self, doc_hash: str):
+        shutil.rmtree(self._document_dir(doc_hash), ignore_errors=True)
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import chromadb
+
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from config import settings
+
+
+class CollectionRegistry:
+    """Thread-safe registry of per-document ChromaDB collections.
+
+    Every document gets its own collection so a similarity search only scans the
+    chunks of the document being asked about. Handles are shared between requests,
+    each document has its own lock for ingestion, and handles that have not been
+    used for `idle_ttl` seconds are closed. `delete_on_expiry` may be a callable
+    that decides per document whether its collection is deleted as well.
+    """
+
+    def __init__(self,
+                 embedding_function: Embeddings,
+                 persist_directory: str = settings.CHROMA_PERSIST_DIRECTORY,
+                 idle_ttl: int = settings.CHROMA_COLLECTION_IDLE_TTL,
+                 delete_on_expiry: Union[bool, Callable[[str], bool]] = False):
+        self.embedding_function = embedding_function
+        self.idle_ttl = idle_ttl
+        self.delete_on_expiry = delete_on_expiry
+        self._client = chromadb.PersistentClient(path=persist_directory)
+        self._handles: Dict[str, Chroma] = {}
+        self._last_used: Dict[str, float] = {}
+        self._doc_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def collection_name(doc_hash: str) -> str:
+        return f"{settings.CHROMA_COLLECTION_NAME}-{doc_hash[:32]}"
+
+    def get(self, doc_hash: str) -> Chroma:
+        """Get the vector store for a document, opening or creating its collection if needed"""
+        # The document being looked up is in use, so the sweep must not expire it
+        self._expire_idle(keep=doc_hash)
+        with self._lock:
+            handle = self._handles.get(doc_hash)
+            if handle is None:
+                handle = Chroma(
+                    collection_name=self.collection_name(doc_hash),
+                    embedding_function=self.embedding_function,
+                    client=self._client,
+                    # The name only holds a prefix of the hash, so the whole hash is kept to find the
+                    # document again after a restart
+                    collection_metadata={'hnsw:space': settings.CHROMA_DISTANCE_FUNCTION, 'document': doc_hash}
+                )
+                self._handles[doc_hash] = handle
+            self._last_used[doc_hash] = time.monotonic()
+            return handle
+
+    def track_stored(self, doc_hashes: Iterable[str] = ()):
+        """Start the idle clock of the collections stored before a restart
+
+        Only collections opened since startup would otherwise ever be swept, so documents
+        kept across restarts would never be closed or, where `delete_on_expiry` allows,
+        deleted. Collections are matched to their documents by the hash recorded in their
+        metadata, or, for older collections, by name among `doc_hashes`.
+        """
+        names = {self.collection_name(doc_hash): doc_hash for doc_hash in doc_hashes}
+        try:
+            collections = self._client.list_collections()
+        except Exception as e:
+            print(f"Error listing stored collections: {e}")
+            return
+        now = time.monotonic()
+        with self._lock:
+            for collection in collections:
+                doc_hash = (collection.metadata or {}).get('document') or names.get(collection.name)
+                if doc_hash is not None:
+                    self._last_used.setdefault(doc_hash, now)
+
+    def lock(self, doc_hash: str) -> threading.Lock:
+        """Get the lock that serializes ingestion of a document"""
+        # Locks are kept for the registry's lifetime: replacing one that another thread
+        # already holds a reference to would let two ingestions of a document run at once
+        with self._lock:
+            return self._doc_locks.setdefault(doc_hash, threading.Lock())
+
+    def exists(self, doc_hash: str) -> bool:
+        with self._lock:
+            if doc_hash in self._handles:
+                return True
+        try:
+            self._client.get_collection(self.collection_name(doc_hash))
+            return True
+        except Exception:
+            return False
+
+    def drop(self, doc_hash: str):
+        """Delete a document's collection and close its handle"""
+        with self.lock(doc_hash):
+            with self._lock:
+                self._handles.pop(doc_hash, None)
+                self._last_used.pop(doc_hash, None)
+            self._delete_collection(doc_hash)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'open_collections': len(self._handles),
+                'idle_ttl': self.idle_ttl,
+            }
+
+    def _delete_collection(self, doc_hash: str):
+        try:
+            self._client.delete_collection(self.collection_name(doc_hash))
+        except Exception as e:
+            print(f"Error deleting collection for document {doc_hash[:12]}: {e}")
+
+    def _expire_idle(self, keep: Optional[str] = None):
+        now = time.monotonic()
+        with self._lock:
+            # Sweeping is cheap, but there is no need to do it on every lookup
+            if now - self._last_sweep < min(self.idle_ttl, 60):
+                return
+            self._last_sweep = now
+            expired: List[str] = [doc_hash for doc_hash, last_used in self._last_used.items()
+                                  if now - last_used > self.idle_ttl and doc_hash != keep]
+            for doc_hash in expired:
+                self._handles.pop(doc_hash, None)
+                self._last_used.pop(doc_hash, None)
+
+        for doc_hash in expired:
+            print(f"Closing idle collection for document {doc_hash[:12]}")
+            delete = self.delete_on_expiry(doc_hash) if callable(self.delete_on_expiry) else self.delete_on_expiry
+            if delete:
+                with self.lock(doc_hash):
+                    # Another request may have opened the document again since it was closed
+                    with self._lock:
+                        reopened = doc_hash in self._handles
+                    if not reopened:
+                        self._delete_collection(doc_hash)
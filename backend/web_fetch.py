@@ -0,0 +1,230 @@
+import asyncio
+import time
+
+import httpx
+
+from bs4 import BeautifulSoup
+from cachetools import LRUCache
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import settings
+from metrics import RequestTimings, record_stage, stage_timer
+
+# Elements that never hold a page's main text
+NON_CONTENT_TAGS = ['script', 'style', 'noscript', 'template', 'svg', 'iframe', 'form',
+                    'nav', 'header', 'footer', 'aside']
+
+
+def extract_main_text(content: bytes, encoding: Optional[str], is_html: bool = True) -> Tuple[str, str]:
+    """Extract the title and readable main text of a page
+
+    Navigation, scripts and other page furniture are removed, and the text of the
+    <main> or <article> element is preferred over the whole body.
+    """
+    if not is_html:
+        return '', content.decode(encoding or 'utf-8', errors='replace').strip()
+
+    soup = BeautifulSoup(content, 'lxml', from_encoding=encoding)
+    title = soup.title.get_text(strip=True) if soup.title else ''
+    for tag in soup(NON_CONTENT_TAGS):
+        tag.decompose()
+
+    text = ''
+    for root in (soup.find('main'), soup.find(attrs={'role': 'main'}), soup.find('article'), soup.body, soup):
+        if root is None:
+            continue
+        lines = (" ".join(line.split()) for line in root.get_text("\n").splitlines())
+        text = "\n".join(line for line in lines if line)
+        if len(text) >= settings.WEB_PAGE_MIN_CHARS:
+            break
+    return title, text
+
+
+class PageCache:
+    """LRU cache of extracted pages keyed by URL.
+
+    Pages are used as they are for `ttl` seconds. After that they are revalidated
+    with their ETag or Last-Modified date, so unchanged pages are neither downloaded
+    nor extracted again. Only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(self,
+                 max_entries: int = settings.WEB_PAGE_CACHE_MAX_ENTRIES,
+                 ttl: int = settings.WEB_PAGE_CACHE_TTL):
+        self._entries = LRUCache(maxsize=max_entries)
+        self.ttl = ttl
+        self._stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'stale_served': 0}
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Get the cached entry for a URL, fresh or not"""
+        return self._entries.get(url)
+
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.monotonic() - entry['fetched_at'] < self.ttl
+
+    def put(self, url: str, page: Dict, etag: Optional[str], last_modified: Optional[str]):
+        self._entries[url] = {'page': page, 'etag': etag, 'last_modified': last_modified,
+                              'fetched_at': time.monotonic()}
+
+    def refresh(self, url: str):
+        """Mark a cached page as fresh again after the server confirmed it is unchanged"""
+        entry = self._entries.get(url)
+        if entry is not None:
+            entry['fetched_at'] = time.monotonic()
+
+    def record(self, outcome: str):
+        self._stats[outcome] += 1
+
+    def stats(self) -> Dict:
+        lookups = self._stats['hits'] + self._stats['revalidated'] + self._stats['misses']
+        hits = self._stats['hits'] + self._stats['revalidated']
+        return dict(self._stats, entries=len(self._entries), max_entries=self._entries.maxsize,
+                    ttl=self.ttl, hit_rate=hits / lookups if lookups else 0.0)
+
+
+class WebPageFetcher:
+    """Fetches search result pages concurrently over one pooled HTTP client.
+
+    Every page gets its own timeout, and the whole fan-out must finish within a
+    latency budget: pages still loading when it runs out are dropped (or served
+    from a stale cache entry) instead of delaying the answer. HTML is extracted on
+    the given executor so parsing never blocks the event loop.
+    """
+
+    def __init__(self, executor: Executor,
+                 cache: Optional[PageCache] = None,
+                 budget_ms: int = settings.WEB_FETCH_BUDGET_MS,
+                 timeout: float = settings.WEB_FETCH_TIMEOUT,
+                 host_timeouts: Optional[Dict[str, float]] = None,
+                 max_bytes: int = settings.WEB_FETCH_MAX_BYTES):
+        self._executor = executor
+        self.cache = cache or PageCache()
+        self.budget = budget_ms / 1000
+        self.timeout = timeout
+        self.host_timeouts = settings.WEB_FETCH_HOST_TIMEOUTS if host_timeouts is None else host_timeouts
+        self.max_bytes = max_bytes
+        self._client = httpx.AsyncClient(
+            follow_redirects=True,
+            headers={'User-Agent': settings.WEB_FETCH_USER_AGENT, 'Accept': 'text/html,text/plain;q=0.9'},
+            limits=httpx.Limits(max_connections=settings.WEB_FETCH_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.WEB_FETCH_MAX_CONNECTIONS)
+        )
+        self._stats = {'fetched': 0, 'failed': 0, 'dropped': 0}
+
+    async def fetch(self, urls: Sequence[str], timings: Optional[RequestTimings] = None) -> List[Dict]:
+        """Fetch and extract pages concurrently within the latency budget
+
+        Args:
+            urls: Page URLs in order of preference
+            timings: Collects the duration of the fetch and extraction stages
+
+        Returns:
+            The pages that were ready in time, as dicts with url, title and text, in input order
+        """
+        if not urls:
+            return []
+        tasks = [asyncio.create_task(self._fetch_page(url, timings)) for url in urls]
+        try:
+            with stage_timer('web_fetch', timings):
+                done, pending = await asyncio.wait(tasks, timeout=self.budget)
+        finally:
+            # Also stops the fetches when the caller gives up first
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        if pending:
+            self._stats['dropped'] += len(pending)
+            print(f"Dropped {len(pending)} of {len(tasks)} web pages that missed the {self.budget}s budget")
+
+        pages = []
+        for url, task in zip(urls, tasks):
+            page = task.result() if task in done else None
+            if page is None and task in pending:
+                # A stale copy is better than nothing when the site is too slow to revalidate
+                entry = self.cache.get(url)
+                if entry is not None:
+                    self.cache.record('stale_served')
+                    page = entry['page']
+            if page is not None:
+                pages.append(page)
+        return pages
+
+    async def close(self):
+        await self._client.aclose()
+
+    def stats(self) -> Dict:
+        return dict(self._stats, cache=self.cache.stats())
+
+    def _timeout_for(self, url: str) -> float:
+        return self.host_timeouts.get(httpx.URL(url).host, self.timeout)
+
+    async def _fetch_page(self, url: str, timings: Optional[RequestTimings] = None) -> Optional[Dict]:
+        """Get one page from the cache or the web; returns None if it can't be used"""
+        entry = self.cache.get(url)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.record('hits')
+            return entry['page']
+
+        try:
+            timeout = self._timeout_for(url)
+            download = await asyncio.wait_for(self._download(url, entry, timeout), timeout)
+        except Exception as e:
+            self._stats['failed'] += 1
+            print(f"Error fetching {url}: {e!r}")
+            return entry['page'] if entry is not None else None
+
+        if download is None:
+            # Not modified
+            self.cache.record('revalidated')
+            self.cache.refresh(url)
+            return entry['page']
+
+        self.cache.record('misses')
+        content, encoding, is_html, etag, last_modified = download
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            title, text = await loop.run_in_executor(self._executor, extract_main_text, content, encoding, is_html)
+        except Exception as e:
+            self._stats['failed'] += 1
+            print(f"Error extracting text from {url}: {e}")
+            return None
+        finally:
+            record_stage('web_extract', time.perf_counter() - start, timings)
+        if len(text) < settings.WEB_PAGE_MIN_CHARS:
+            # Mostly pages that render their content with JavaScript
+            self._stats['failed'] += 1
+            return None
+
+        self._stats['fetched'] += 1
+        page = {'url': url, 'title': title, 'text': text}
+        self.cache.put(url, page, etag, last_modified)
+        return page
+
+    async def _download(self, url: str, entry: Optional[Dict],
+                        timeout: float) -> Optional[Tuple[bytes, Optional[str], bool, Optional[str], Optional[str]]]:
+        """Download a page, or return None if the cached entry is still current"""
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        async with self._client.stream('GET', url, headers=headers, timeout=timeout) as response:
+            if response.status_code == 304 and entry is not None:
+                return None
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '').lower()
+            is_html = 'html' in content_type
+            if not is_html and not content_type.startswith('text/plain'):
+                raise ValueError(f"unsupported content type '{content_type}'")
+
+            # Read at most max_bytes so huge pages can't hold up the fan-out
+            content = bytearray()
+            async for data in response.aiter_bytes():
+                content.extend(data)
+                if len(content) >= self.max_bytes:
+                    del content[self.max_bytes:]
+                    break
+            return (bytes(content), response.charset_encoding, is_html,
+                    response.headers.get('etag'), response.headers.get('last-modified'))
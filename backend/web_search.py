@@ -1,5 +1,6 @@
 from typing import List, Dict, Optional
 from duckduckgo_search import DDGS
+from search_cache import search_cache
 
 class WebSearchManager:
     def __init__(self):
@@ -16,9 +17,15 @@ class WebSearchManager:
         Returns:
             List of search results with title, body, and href
         """
+        cached = search_cache.get('duckduckgo', query, max_results)
+        if cached is not None:
+            return cached
+        
         try:
             results = list(self.ddgs.text(query, max_results=max_results))
             print("Result ", results)
+            if results:
+                search_cache.put('duckduckgo', query, max_results, results)
             return results
         except Exception as e:
             print(f"Error during web search: {e}")
@@ -35,8 +42,18 @@ class WebSearchManager:
         Returns:
             Formatted string with search results
         """
-        results = self.search(query, max_results)
+        return self.format_search_context(self.search(query, max_results))
+    
+    def format_search_context(self, results: List[Dict]) -> str:
+        """
+        Format already retrieved search results as context for the model
         
+        Args:
+            results: Results returned by search()
+            
+        Returns:
+            Formatted string with search results
+        """
         if not results:
             return "No relevant information found on the web."
             
@@ -3,6 +3,9 @@ import os
 from googleapiclient.discovery import build
 from dotenv import load_dotenv
 from typing import List, Dict, Optional
+from langchain_core.documents import Document
+from lazy_resource import LazyResource
+from search_cache import search_cache
 
 load_dotenv()
 
@@ -10,7 +13,14 @@ class WebSearchGoogleManager:
     def __init__(self):
         self.api_key = os.getenv('GOOGLE_API_KEY')
         self.cse_id = os.getenv('GOOGLE_CSE_ID')
-        self.service = build('customsearch', 'v1', developerKey=self.api_key)
+        # Building the discovery client is slow, so defer it until the first search
+        self.service_client = LazyResource(
+            'Google search client', lambda: build('customsearch', 'v1', developerKey=self.api_key)
+        )
+    
+    @property
+    def service(self):
+        return self.service_client.get()
     
     def search(self, query: str, max_results: int = 5) -> List[Dict]:
         """
@@ -23,8 +33,14 @@ class WebSearchGoogleManager:
         Returns:
             List of search results with title, body, and href
         """
+        cached = search_cache.get('google', query, max_results)
+        if cached is not None:
+            return cached
+        
         try:
             results = list(self.service.cse().list(q=query, cx=self.cse_id, num=max_results).execute().get('items', []))
+            if results:
+                search_cache.put('google', query, max_results, results)
             return results
         except Exception as e:
             print(f"Error during web search: {e}")
@@ -41,8 +57,18 @@ class WebSearchGoogleManager:
         Returns:
             Formatted string with search results
         """
-        results = self.search(query, max_results)
+        return self.format_search_context(self.search(query, max_results))
+    
+    def format_search_context(self, results: List[Dict]) -> str:
+        """
+        Format already retrieved search results as context for the model
         
+        Args:
+            results: Results returned by search()
+            
+        Returns:
+            Formatted string with search results
+        """
         if not results:
             return "No relevant information found on the web."
             
@@ -55,4 +81,31 @@ class WebSearchGoogleManager:
             
             context_parts.append(f"[{i}] {title}\n{body}\nSource: {href}\n")
         
-        return "\n".join(context_parts)
\ No newline at end of file
+        return "\n".join(context_parts)
+    
+    def format_page_context(self, chunks: List[Document]) -> str:
+        """
+        Format chunks selected from fetched result pages as context for the model
+        
+        Args:
+            chunks: Page chunks with the url and title of their page in the metadata
+            
+        Returns:
+            Formatted string with the chunks grouped by page
+        """
+        if not chunks:
+            return "No relevant information found on the web."
+        
+        pages: Dict[str, List[Document]] = {}
+        for chunk in chunks:
+            pages.setdefault(chunk.metadata['source'], []).append(chunk)
+        
+        context_parts = []
+        
+        for i, (href, page_chunks) in enumerate(pages.items(), 1):
+            title = page_chunks[0].metadata.get('title') or 'Untitled'
+            body = "\n\n".join(chunk.page_content for chunk in page_chunks)
+            
+            context_parts.append(f"[{i}] {title}\n{body}\nSource: {href}\n")
+        
+        return "\n".join(context_parts)